@@ -0,0 +1,293 @@
+"""JSON API for Blogly, mounted at /api/v1.
+
+Listings and lookups select plain column tuples rather than ORM objects and
+support:
+
+    ?fields[posts]=id,title     sparse fieldsets, per resource type
+    ?after=<id>&limit=<n>       keyset pagination on id
+    ?include=posts              related objects, fetched with one query per relation
+
+POST /api/v1/batch applies a list of create/update/delete operations in a single
+transaction; an attribute value of "$<n>" refers to the id created by operation n.
+Malformed operations, including attribute values of the wrong JSON type, get a 400.
+"""
+
+from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import db, User, Post, Tag, Post_Tag, set_post_tags, invalidate_tags, invalidate_user_pages, tag_ids_for_posts, recount_tags
+from search import unindex_posts, unindex_user
+from feeds import refresh_feeds
+from jobs import jobs
+
+api = Blueprint('api', __name__)
+
+MAX_LIMIT = 100
+
+RESOURCES = {
+    'users': (User, ['id', 'first_name', 'last_name', 'image_url', 'updated_at']),
+    'posts': (Post, ['id', 'title', 'content', 'created_at', 'updated_at', 'user_id']),
+    'tags': (Tag, ['id', 'name']),
+}
+
+WRITABLE = {
+    'users': {'first_name', 'last_name', 'image_url'},
+    'posts': {'title', 'content', 'user_id', 'tag_ids'},
+    'tags': {'name'},
+}
+
+# Type of each writable attribute: 'text', 'text or null', 'an integer' or 'a list of integers'.
+ATTRIBUTE_TYPES = {
+    'first_name': 'text', 'last_name': 'text', 'image_url': 'text', 'name': 'text', 'title': 'text',
+    'content': 'text or null', 'user_id': 'an integer', 'tag_ids': 'a list of integers',
+}
+
+OPS = ('create', 'update', 'delete')
+
+REQUIRED = {
+    'users': {'first_name', 'last_name'},
+    'posts': {'user_id'},
+    'tags': {'name'},
+}
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@api.errorhandler(ApiError)
+def handle_api_error(error):
+    return jsonify({'error': error.message}), error.status
+
+@api.errorhandler(404)
+def handle_not_found(error):
+    return jsonify({'error': 'not found'}), 404
+
+def resource(kind):
+    if kind not in RESOURCES:
+        raise ApiError(f'unknown resource type {kind!r}', 404)
+    return RESOURCES[kind]
+
+def fields_for(kind):
+    """Columns requested for `kind` with ?fields[kind]=, always including id."""
+    model, columns = resource(kind)
+    requested = request.args.get(f'fields[{kind}]')
+    if not requested:
+        return columns
+    names = [name for name in requested.split(',') if name]
+    unknown = set(names) - set(columns)
+    if unknown:
+        raise ApiError(f'unknown fields for {kind}: {", ".join(sorted(unknown))}')
+    return ['id'] + [name for name in names if name != 'id']
+
+def select_rows(kind, extra=(), *criteria):
+    """Requested column names of `kind`, and a query selecting them as plain tuples instead of ORM objects."""
+    model, _ = resource(kind)
+    names = fields_for(kind)
+    columns = [getattr(model, name) for name in names] + list(extra)
+    query = db.session.query(*columns).filter(*criteria)
+    return names, query
+
+def serialize(names, row):
+    item = {}
+    for name, value in zip(names, row):
+        item[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return item
+
+RELATIONS = {
+    # (type, include): (related type, column grouping related rows by parent id, join, to-many)
+    ('users', 'posts'): ('posts', Post.user_id, None, True),
+    ('posts', 'user'): ('users', Post.id, (Post, Post.user_id == User.id), False),
+    ('posts', 'tags'): ('tags', Post_Tag.post_id, (Post_Tag, Post_Tag.tag_id == Tag.id), True),
+    ('tags', 'posts'): ('posts', Post_Tag.tag_id, (Post_Tag, Post_Tag.post_id == Post.id), True),
+}
+
+def parse_includes(kind):
+    includes = [name for name in request.args.get('include', '').split(',') if name]
+    unknown = {name for name in includes if (kind, name) not in RELATIONS}
+    if unknown:
+        raise ApiError(f'cannot include {", ".join(sorted(unknown))} on {kind}')
+    return includes
+
+def attach_includes(kind, items, includes):
+    """Add the requested related objects to `items`, with one query per relation."""
+    ids = [item['id'] for item in items]
+    if not ids:
+        return
+    for include in includes:
+        related_kind, group_column, join, many = RELATIONS[(kind, include)]
+        names, query = select_rows(related_kind, [group_column], group_column.in_(ids))
+        if join is not None:
+            query = query.join(*join)
+        groups = {}
+        for row in query.order_by(resource(related_kind)[0].id):
+            groups.setdefault(row[-1], []).append(serialize(names, row[:-1]))
+        for item in items:
+            group = groups.get(item['id'], [])
+            item[include] = group if many else (group[0] if group else None)
+
+@api.route('/<kind>')
+def list_resources(kind):
+    model, _ = resource(kind)
+    includes = parse_includes(kind)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_LIMIT)
+    after = request.args.get('after', type=int)
+
+    names, query = select_rows(kind)
+    if after is not None:
+        query = query.filter(model.id > after)
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    items = [serialize(names, row) for row in rows[:limit]]
+    attach_includes(kind, items, includes)
+
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    return jsonify({'data': items, 'links': {'next': next_cursor}})
+
+@api.route('/<kind>/<int:id>')
+def get_resource(kind, id):
+    model, _ = resource(kind)
+    includes = parse_includes(kind)
+    names, query = select_rows(kind, (), model.id == id)
+    row = query.first()
+    if row is None:
+        raise ApiError('not found', 404)
+    item = serialize(names, row)
+    attach_includes(kind, [item], includes)
+    return jsonify({'data': item})
+
+@api.route('/batch', methods=['POST'])
+def batch():
+    """Apply every operation in one transaction, or none of them."""
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise ApiError('expected a non-empty "operations" list')
+
+    created_ids = []
+    changes = {'users': set(), 'posts': set(), 'deleted_posts': set(), 'deleted_users': set(), 'tags': False}
+    results = []
+    try:
+        for index, operation in enumerate(operations):
+            try:
+                result = apply_operation(operation, created_ids, changes)
+            except ApiError as error:
+                raise ApiError(f'operation {index}: {error.message}', error.status)
+            except IntegrityError:
+                raise ApiError(f'operation {index}: conflicts with existing data', 409)
+            except DataError:
+                raise ApiError(f'operation {index}: a value is out of range for its column')
+            results.append(result)
+            created_ids.append(result.get('id'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    after_commit(changes)
+    return jsonify({'data': results})
+
+def apply_operation(operation, created_ids, changes):
+    if not isinstance(operation, dict):
+        raise ApiError('expected an object')
+    op = operation.get('op')
+    kind = operation.get('type')
+    if op not in OPS:
+        raise ApiError(f'unknown op {op!r}')
+    if not isinstance(kind, str) or kind not in RESOURCES:
+        raise ApiError(f'unknown resource type {kind!r}')
+    model, _ = resource(kind)
+    attributes = operation.get('attributes') or {}
+    if not isinstance(attributes, dict):
+        raise ApiError('"attributes" must be an object')
+    unknown = set(attributes) - WRITABLE[kind]
+    if unknown:
+        raise ApiError(f'cannot write {", ".join(sorted(unknown))} on {kind}')
+    attributes = resolve_references(attributes, created_ids)
+    for name, value in attributes.items():
+        if not has_type(value, ATTRIBUTE_TYPES[name]):
+            raise ApiError(f'"{name}" must be {ATTRIBUTE_TYPES[name]}')
+
+    if op == 'create':
+        missing = REQUIRED[kind] - set(attributes)
+        if missing:
+            raise ApiError(f'missing {", ".join(sorted(missing))}')
+        obj = model()
+    else:
+        obj_id = resolve_references({'id': operation.get('id')}, created_ids)['id']
+        if not has_type(obj_id, 'an integer'):
+            raise ApiError('"id" must be an integer')
+        obj = model.query.get(obj_id)
+        if obj is None:
+            raise ApiError(f'{kind} {operation.get("id")} not found', 404)
+
+    if op == 'delete':
+        record_change(kind, obj, changes, deleted=True)
+        tag_ids = set()
+        if kind != 'tags':
+            tag_ids = tag_ids_for_posts(Post.id == obj.id if kind == 'posts' else Post.user_id == obj.id)
+        model.query.filter_by(id=obj.id).delete()
+        recount_tags(tag_ids)
+        return {'op': op, 'type': kind, 'id': obj.id}
+
+    tag_ids = attributes.pop('tag_ids', None)
+    if kind == 'posts' and op == 'update':
+        changes['users'].add(obj.user_id)  # the old author, should user_id change
+    for name, value in attributes.items():
+        setattr(obj, name, value)
+    if kind == 'posts' and not User.query.get(obj.user_id):
+        raise ApiError(f'user {obj.user_id} not found', 404)
+    db.session.add(obj)
+    db.session.flush()
+    if tag_ids is not None:
+        set_post_tags(obj, tag_ids, touch=op != 'create')
+    if kind == 'posts':
+        refresh_feeds([obj.id], new=op == 'create')
+    record_change(kind, obj, changes)
+    return {'op': op, 'type': kind, 'id': obj.id}
+
+def has_type(value, expected):
+    """True if a JSON value is of one of the ATTRIBUTE_TYPES; booleans are not integers."""
+    if expected == 'text':
+        return isinstance(value, str)
+    if expected == 'text or null':
+        return value is None or isinstance(value, str)
+    if expected == 'an integer':
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, list) and all(has_type(item, 'an integer') for item in value)
+
+def resolve_references(attributes, created_ids):
+    """Replace "$<n>" values, also inside lists, with the id created by operation n of the batch."""
+    def resolve(value):
+        if isinstance(value, list):
+            return [resolve(item) for item in value]
+        if isinstance(value, str) and value.startswith('$') and value[1:].isdigit():
+            index = int(value[1:])
+            if index >= len(created_ids) or created_ids[index] is None:
+                raise ApiError(f'{value} does not refer to an earlier create')
+            return created_ids[index]
+        return value
+    return {name: resolve(value) for name, value in attributes.items()}
+
+def record_change(kind, obj, changes, deleted=False):
+    if kind == 'users':
+        changes['users'].add(obj.id)
+        if deleted:
+            changes['deleted_users'].add(obj.id)
+    elif kind == 'posts':
+        changes['users'].add(obj.user_id)
+        (changes['deleted_posts'] if deleted else changes['posts']).add(obj.id)
+    else:
+        changes['tags'] = True
+
+def after_commit(changes):
+    """Keep caches and the search index in step with a committed batch."""
+    for user_id in changes['users']:
+        invalidate_user_pages(user_id)
+    if changes['tags']:
+        invalidate_tags()
+    unindex_posts(changes['deleted_posts'])
+    for user_id in changes['deleted_users']:
+        unindex_user(user_id)
+    for post_id in changes['posts'] - changes['deleted_posts']:
+        jobs.enqueue('reindex_post', post_id, key=f'reindex_post:{post_id}')
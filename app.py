@@ -1,81 +1,207 @@
 """Blogly application."""
 
-from flask import Flask, request, render_template, redirect, flash
+from flask import Flask, Blueprint, abort, current_app, request, render_template, redirect, jsonify, make_response
 from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, User, Post, Tag, Post_Tag, check_if_users_post, tag_in_posts_by_ids
+from models import db, connect_db, User, Post, Tag, Post_Tag, check_if_users_post, set_post_tags, all_tags, invalidate_tags, invalidate_user_pages, tag_post_counts, most_used_tags
+from sqlalchemy.orm import load_only
+from pagination import keyset_page, sequence_page, parse_timeline_cursor
+from config import Config, engine_options
+from query_stats import init_query_stats
+from migrations import upgrade_db_command
+from search import search_posts
+from feeds import SITE_FEED, init_feeds, refresh_feeds, feed_page, user_feed, tag_feed
+from deletes import run_delete, delete_user, delete_post, delete_tag
+from jobs import jobs, init_jobs
+from replicas import init_replicas, read_from_primary
+from rendering import init_rendering, render_streamed
+from metrics import init_metrics, render_metrics
+from profiling import init_profiling
+from cache import caches, page_cache, init_caches
+from api import api
+from cli import blogly as blogly_cli
 from datetime import datetime
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SECRET_KEY'] = 'thisisacoolproject1000'
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-debug = DebugToolbarExtension(app)
-
-connect_db(app)
-db.create_all()
-
-@app.route('/') #Root to homepage redirection route
+from functools import wraps
+from math import log
+from hashlib import sha1
+
+blogly = Blueprint('blogly', __name__)
+
+def create_app(config=Config, **overrides):
+    """Build a Blogly app.
+
+    Nothing here touches the database: the engine and its pool are created on the
+    first query, and schema changes are applied separately with `flask upgrade-db`.
+    Serve with e.g. `gunicorn "app:create_app()"`.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(overrides)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    if app.debug:
+        DebugToolbarExtension(app)
+
+    init_caches(app)
+    init_metrics(app)
+    init_profiling(app)
+    init_feeds(app)
+    init_rendering(app)
+    init_query_stats(app)
+    init_jobs(app)
+    init_replicas(app, db)
+    connect_db(app)
+    app.register_blueprint(blogly)
+    app.register_blueprint(api, url_prefix='/api/v1')
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(blogly_cli)
+    return app
+
+def cursor_args():
+    """The ?after= / ?before= keyset cursors of the request, plus the page size."""
+    return {'after': request.args.get('after', type=int),
+            'before': request.args.get('before', type=int),
+            'per_page': current_app.config['PAGE_SIZE']}
+
+def feed_cursor_args():
+    """The ?after= / ?before= timeline cursors of the request, plus the page size."""
+    return {'after': parse_timeline_cursor(request.args.get('after')),
+            'before': parse_timeline_cursor(request.args.get('before')),
+            'per_page': current_app.config['PAGE_SIZE']}
+
+FEED_FORMATS = {'html': ('feed.html', 'text/html'),
+                'atom': ('feed.atom.xml', 'application/atom+xml'),
+                'rss': ('feed.rss.xml', 'application/rss+xml')}
+
+def cached_feed(view):
+    """Serve a timeline as HTML, Atom or RSS from the page cache, with a strong ETag.
+
+    The view returns (title, feed key, path of the page the feed is about), or
+    aborts with a 404. Entries are keyed on the 'feeds' page generation, which
+    invalidate_user_pages bumps whenever a post changes, and filled from the primary.
+    There is no Last-Modified: the newest entry's time goes back when that post is
+    deleted, and clients would keep the copy that still shows it.
+    """
+    @wraps(view)
+    def wrapper(fmt='html', **kwargs):
+        key = f'feeds:{page_cache.generation("feeds")}:{request.full_path}'
+        entry = page_cache.get(key)
+        if entry is None:
+            read_from_primary()
+            title, feed, link = view(**kwargs)
+            page = feed_page(feed, **feed_cursor_args())
+            updated = max((item.updated_at for item in page.items), default=datetime(1970, 1, 1))
+            template, mimetype = FEED_FORMATS[fmt]
+            body = render_template(template, title=title, link=link, entries=page.items, page=page, updated=updated)
+            entry = (body, mimetype, sha1(body.encode()).hexdigest())
+            page_cache.set(key, entry)
+
+        body, mimetype, etag = entry
+        response = make_response(body)
+        response.mimetype = mimetype
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+
+def cached_page(view):
+    """Serve a user's page from the page cache, with a strong ETag and Last-Modified for conditional GETs.
+
+    The view returns (html, last_modified) to have the page cached, or any other
+    response to bypass the cache; last_modified may be None for pages whose content
+    is not covered by any timestamp. Entries are keyed on the user's page generation,
+    which invalidate_user_pages bumps whenever the user or one of their posts changes;
+    a miss reads from the primary, never a replica. With several worker processes,
+    set CACHE_BACKEND so a bump in one reaches all.
+    """
+    @wraps(view)
+    def wrapper(user_id, **kwargs):
+        scope = f'user:{user_id}'
+        key = f'{scope}:{page_cache.generation(scope)}:{request.full_path}'
+        entry = page_cache.get(key)
+        if entry is None:
+            read_from_primary()
+            result = view(user_id, **kwargs)
+            if not isinstance(result, tuple):
+                return result
+            html, last_modified = result
+            entry = (html, sha1(html.encode()).hexdigest(), last_modified)
+            page_cache.set(key, entry)
+
+        html, etag, last_modified = entry
+        response = make_response(html)
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+
+@blogly.route('/') #Root to homepage redirection route
 def redirect_to_user_page():
     return redirect('/users')
 
-@app.route('/users') #The main page
+@blogly.route('/users') #The main page
 def user_list():
     """Shows list of users and a form to add a new user."""
-    users = User.query.all()
-    return render_template('user_list.html', users=users)
+    query = User.query.options(load_only('id', 'first_name', 'last_name'))
+    page = keyset_page(query, User.id, **cursor_args())
+    return render_streamed('user_list.html', users=page.items, page=page)
+
+def user_posts(user_id):
+    """The posts listed on a user's page; keyset-paged on Post.id through ix_posts_user_id_id."""
+    return Post.query.filter(Post.user_id == user_id).options(load_only('id', 'title'))
 
-@app.route('/users/<int:user_id>') #User details
+@blogly.route('/users/<int:user_id>') #User details
+@cached_page
 def show_user(user_id):
     user = User.query.get_or_404(user_id)
-    posts = Post.query.filter(Post.user_id == user_id).all()
-    return render_template("user_details.html", user=user, posts=posts)
+    page = keyset_page(user_posts(user_id), Post.id, **cursor_args())
+    # No Last-Modified: deleting the newest post would move it back in time, so only the ETag validates the page.
+    return render_template("user_details.html", user=user, posts=page.items, page=page), None
 
-@app.route('/users/<int:user_id>/post/<int:post_id>/<post_title>') #Shows the post in more detail
+@blogly.route('/users/<int:user_id>/post/<int:post_id>/<post_title>') #Shows the post in more detail
+@cached_page
 def show_post(user_id, post_id, post_title):
     user = User.query.get_or_404(user_id)
     post = Post.query.get_or_404(post_id)
     tags = post.tags
 
-    if check_if_users_post(user_id=user_id, post_id=post_id):
+    if post.user_id == user_id:
         post_creation_date = datetime.strftime(post.created_at, "%A, %B %d, %Y, %I:%M %p")
-        return render_template('user_post_page.html', user=user, post=post, creation_date=post_creation_date, tags=tags)
+        # No Last-Modified: the page shows tag names, and renaming a tag touches no timestamp. The ETag still revalidates.
+        return render_template('user_post_page.html', user=user, post=post, creation_date=post_creation_date, tags=tags), None
     return redirect('/users')
 
-@app.route('/users/<int:user_id>/post/<int:post_id>/<post_title>', methods=['POST']) #Edit/Delete action
+@blogly.route('/users/<int:user_id>/post/<int:post_id>/<post_title>', methods=['POST']) #Edit/Delete action
 def action_to_post(user_id, post_id, post_title):
     if request.form['ACTION'] == 'edit':
         return redirect(f'/users/{user_id}/post/{post_id}/{post_title}/edit')
     elif request.form['ACTION'] == 'delete':
-        Post.query.filter_by(id = post_id).delete()
-        db.session.commit()
+        # The post must belong to the user in the URL, whose pages delete_post invalidates.
+        if not check_if_users_post(user_id, post_id):
+            return redirect('/users')
+        run_delete(delete_post, post_id, user_id)
         return redirect(f'/users/{user_id}')
     else:
         return redirect('/users')
 
-@app.route('/users/<int:user_id>/post/<int:post_id>/<post_title>/edit') #Post editting page
+@blogly.route('/users/<int:user_id>/post/<int:post_id>/<post_title>/edit') #Post editting page
 def edit_post(user_id, post_id, post_title):
     user = User.query.get_or_404(user_id)
     post = Post.query.get_or_404(post_id)
-    tags = Tag.query.all()
-    checked_tags = []
-        
-    if check_if_users_post(user_id=user_id, post_id=post_id):
-        for tag in tags:
-            if tag_in_posts_by_ids(tag_id=tag.id, post_id=post_id):
-                checked_tags.append(tag.id)
+    tags = all_tags()
+
+    if post.user_id == user_id:
+        checked_tags = {tag.id for tag in post.tags}
         return render_template("user_post_editting_page.html", user=user,post=post, tags=tags, checked_tags=checked_tags)
     return redirect("/users")
 
-@app.route('/users/<int:user_id>/post/<int:post_id>/<post_title>/edit', methods=['POST']) #Application of the post, content, tag and title changes
+@blogly.route('/users/<int:user_id>/post/<int:post_id>/<post_title>/edit', methods=['POST']) #Application of the post, content, tag and title changes
 def apply_form_changes(user_id, post_id, post_title):
     title = request.form["title"].strip()
     content = request.form["content"].strip()
     editting_post = Post.query.get_or_404(post_id)
-    editting_post.tags.clear()
-    tags = request.form.getlist('tag')
+    tag_ids = request.form.getlist('tag', type=int)
 
     if title:
         editting_post.title = title
@@ -85,47 +211,43 @@ def apply_form_changes(user_id, post_id, post_title):
         editting_post.content = content
 
     db.session.add(editting_post)
+    set_post_tags(editting_post, tag_ids)
+    refresh_feeds([post_id])
     db.session.commit()
-
-    if tags:
-        for x in tags:
-            new_tag = Tag.query.filter(Tag.name == x).first()
-            editting_post.tags.append(new_tag)
-
-    db.session.commit()
+    invalidate_user_pages(editting_post.user_id)
+    jobs.enqueue('reindex_post', post_id, key=f'reindex_post:{post_id}')
 
     return redirect(f'/users/{user_id}/post/{post_id}/{editting_post.title}')
 
 
-@app.route('/users/<int:user_id>', methods=['POST']) #User action: edit/delete/new_post
+@blogly.route('/users/<int:user_id>', methods=['POST']) #User action: edit/delete/new_post
 def action_to_user(user_id):
     if request.form["ACTION"] == 'edit':
         return redirect(f'/users/{user_id}/edit')
     elif request.form["ACTION"] == 'delete':
-        User.query.filter_by(id = user_id).delete()
-        db.session.commit()
+        run_delete(delete_user, user_id)
         return redirect('/users')
     elif request.form["ACTION"] == 'new-post':
         return redirect(f'/users/{user_id}/new-post')
     else:
         return redirect('/users')
 
-@app.route('/users/<int:user_id>/edit') #User editting page
+@blogly.route('/users/<int:user_id>/edit') #User editting page
 def edit_user(user_id):
     user = User.query.get_or_404(user_id)
     return render_template('user_edit.html', user=user)
 
-@app.route('/users/<int:user_id>/new-post') #NEW POST creation page
+@blogly.route('/users/<int:user_id>/new-post') #NEW POST creation page
 def new_post_form(user_id):
     user = User.query.get_or_404(user_id)
-    tags = Tag.query.all()
+    tags = all_tags()
     return render_template('user_post_creation_page.html', user=user, tags=tags)
 
-@app.route('/users/<int:user_id>/new-post', methods=['POST']) #Creation of new post
+@blogly.route('/users/<int:user_id>/new-post', methods=['POST']) #Creation of new post
 def submit_post(user_id):
     title = request.form["title"].strip()
     content = request.form["content"].strip()
-    tags = request.form.getlist('tag')
+    tag_ids = request.form.getlist('tag', type=int)
     post = None
     
     if title:
@@ -134,21 +256,19 @@ def submit_post(user_id):
         post = Post(content=content, user_id=user_id)
 
     db.session.add(post)
+    db.session.flush()
+    set_post_tags(post, tag_ids, touch=False)
+    refresh_feeds([post.id], new=True)
     db.session.commit()
-
-    if tags:
-        for x in tags:
-            new_tag = Tag.query.filter(Tag.name == x).first()
-            post.tags.append(new_tag)
-
-    db.session.commit()
+    invalidate_user_pages(user_id)
+    jobs.enqueue('reindex_post', post.id, key=f'reindex_post:{post.id}')
 
     return redirect(f'/users/{user_id}/post/{post.id}/{post.title}')
 
 
 #Make a route to show the post and its contents
 
-@app.route('/users/<int:user_id>/edit', methods=['POST']) #Application of user profile edits
+@blogly.route('/users/<int:user_id>/edit', methods=['POST']) #Application of user profile edits
 def apply_user_changes(user_id):
     first_name = request.form["first_name"]
     last_name = request.form["last_name"]
@@ -162,10 +282,11 @@ def apply_user_changes(user_id):
 
     db.session.add(editted_user)
     db.session.commit()
+    invalidate_user_pages(user_id)
 
     return redirect(f'/users/{user_id}')
 
-@app.route('/users', methods=['POST']) #Creation of new user
+@blogly.route('/users', methods=['POST']) #Creation of new user
 def create_user():
     first_name = request.form["first_name"]
     last_name = request.form["last_name"]
@@ -182,45 +303,107 @@ def create_user():
 
     return redirect(f'/users/{new_user.id}')
 
-@app.route('/tags') #The tags page
-def tag_list():
-    tags = Tag.query.all()
-    return render_template('tag_list.html', tags=tags)
+@blogly.route('/feed') #Latest posts across the site, also as Atom and RSS
+@blogly.route('/feed.<any(atom, rss):fmt>')
+@cached_feed
+def site_feed():
+    return 'Latest posts', SITE_FEED, '/users'
 
-@app.route('/tags/<int:tag_id>') #Tag details page
+@blogly.route('/users/<int:user_id>/feed') #Latest posts of a user
+@blogly.route('/users/<int:user_id>/feed.<any(atom, rss):fmt>')
+@cached_feed
+def user_posts_feed(user_id):
+    user = User.query.get_or_404(user_id)
+    return f'Posts by {user.first_name} {user.last_name}', user_feed(user_id), f'/users/{user_id}'
+
+@blogly.route('/tags/<int:tag_id>/feed') #Latest posts with a tag
+@blogly.route('/tags/<int:tag_id>/feed.<any(atom, rss):fmt>')
+@cached_feed
+def tag_posts_feed(tag_id):
+    tag = Tag.query.get_or_404(tag_id)
+    return f'Posts tagged {tag.name}', tag_feed(tag_id), f'/tags/{tag_id}'
+
+@blogly.route('/search') #Full-text search over posts
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = search_posts(q, page=page, per_page=current_app.config['SEARCH_PAGE_SIZE']) if q else ([], False)
+    return render_template('search_results.html', q=q, results=results, page=page, has_next=has_next)
+
+@blogly.route('/cache/stats') #Cache hit/miss counters for monitoring
+def cache_stats():
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+@blogly.route('/metrics') #Prometheus metrics: route latency, pool, caches, jobs and replicas
+def metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return render_metrics()
+
+@blogly.route('/jobs/metrics') #Background job queue depth, outcomes and latency
+def job_metrics():
+    return jsonify(jobs.metrics())
+
+@blogly.route('/tags') #The tags page
+def tag_list():
+    tags = all_tags()
+    page = sequence_page(tags, 'id', **cursor_args())
+    counts = tag_post_counts(tag.id for tag in page.items)
+    return render_streamed('tag_list.html', tags=page.items, page=page, counts=counts, cloud=tag_cloud(tags))
+
+def tag_cloud(tags):
+    """The most used tags, alphabetically, each with its post count and a font size in rem."""
+    popular = most_used_tags(current_app.config['TAG_CLOUD_SIZE'])
+    if not popular:
+        return []
+    by_id = {tag.id: tag for tag in tags}
+    scale = log(1 + popular[0][1])
+    cloud = [(by_id[tag_id], count, round(0.9 + 1.3 * log(1 + count) / scale, 2))
+             for tag_id, count in popular if tag_id in by_id]
+    return sorted(cloud, key=lambda entry: entry[0].name.lower())
+
+def tag_posts(tag_id):
+    """The posts listed on a tag's page with their authors; keyset-paged on Post_Tag.post_id through ix_post_tags_tag_id_post_id."""
+    return (db.session.query(Post_Tag.post_id, Post.title, Post.user_id, User.first_name, User.last_name)
+            .select_from(Post_Tag)
+            .join(Post, Post.id == Post_Tag.post_id)
+            .join(User, User.id == Post.user_id)
+            .filter(Post_Tag.tag_id == tag_id))
+
+@blogly.route('/tags/<int:tag_id>') #Tag details page
 def show_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
-    posts = tag.posts
-    return render_template('tag_details.html', tag=tag, posts=posts)
+    page = keyset_page(tag_posts(tag_id), Post_Tag.post_id, **cursor_args())
+    return render_streamed('tag_details.html', tag=tag, posts=page.items, page=page)
 
-@app.route('/tags', methods=['POST']) #Creation of new tag
+@blogly.route('/tags', methods=['POST']) #Creation of new tag
 def create_tag():
     tag_name = request.form["tag_name"].strip()
-    if tag_name and not Tag.query.filter(Tag.name == tag_name).all():
+    if tag_name and not Tag.query.filter(db.func.lower(Tag.name) == tag_name.lower()).first():
         new_tag = Tag(name=tag_name)
         db.session.add(new_tag)
         db.session.commit()
+        invalidate_tags()
         return redirect(f'/tags/{new_tag.id}')
 
     return redirect('/tags')
     
-@app.route('/tags/<int:tag_id>', methods=['POST']) #Edit/Delete action
+@blogly.route('/tags/<int:tag_id>', methods=['POST']) #Edit/Delete action
 def action_to_tag(tag_id):
      if request.form["ACTION"] == 'edit':
         return redirect(f'/tags/{tag_id}/edit')
      elif request.form["ACTION"] == 'delete':
-        Tag.query.filter_by(id = tag_id).delete()
-        db.session.commit()
+        run_delete(delete_tag, tag_id)
         return redirect('/tags')
      else:
         return redirect('/tags')
 
-@app.route('/tags/<int:tag_id>/edit') #Tag editting page
+@blogly.route('/tags/<int:tag_id>/edit') #Tag editting page
 def edit_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
     return render_template('tag_edit.html', tag=tag)
 
-@app.route('/tags/<int:tag_id>/edit', methods=['POST']) #Application of changes to the tag
+@blogly.route('/tags/<int:tag_id>/edit', methods=['POST']) #Application of changes to the tag
 def apply_tag_changes(tag_id):
     editted_tag_name = request.form['tag_name'].strip()
     if editted_tag_name:
@@ -228,5 +411,6 @@ def apply_tag_changes(tag_id):
         editted_tag.name = editted_tag_name
         db.session.add(editted_tag)
         db.session.commit()
+        invalidate_tags()
         return redirect(f'/tags/{tag_id}')
     return redirect('/tags/<int:tag_id>/edit')
\ No newline at end of file
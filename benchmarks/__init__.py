@@ -0,0 +1,14 @@
+"""Benchmarks for Blogly.
+
+Everything runs against throwaway SQLite databases, so no Postgres server is needed:
+
+    python -m benchmarks routes --users 200 --posts-per-user 20 --tags-per-post 3 --output report.json
+    python -m benchmarks routes --baseline benchmarks/baseline.json   exit 1 on a regression
+    python -m benchmarks compare old.json new.json
+    python -m benchmarks load --requests 2000 --concurrency 100       HTTP load against serve.py
+    python -m benchmarks queries 10000 100000                         listing queries by table size
+    python -m benchmarks startup                                      app startup and first request
+
+`routes` times every route in the app with the Flask test client and records
+latency percentiles, queries per request and peak memory allocated per request.
+"""
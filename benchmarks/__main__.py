@@ -0,0 +1,77 @@
+import argparse
+import sys
+
+from benchmarks import __doc__ as usage
+from benchmarks import load, queries
+from benchmarks.datasets import dataset
+from benchmarks.report import build_report, compare, load_report, print_routes, save
+from benchmarks.routes import run_routes, uncovered_endpoints
+
+def routes_command(args):
+    sizes = {'users': args.users, 'posts_per_user': args.posts_per_user,
+             'tags_per_post': args.tags_per_post, 'tags': args.tags}
+    with dataset(**sizes) as app:
+        missing = uncovered_endpoints(app)
+        if missing:
+            sys.exit(f'no benchmark case for: {", ".join(missing)}')
+        routes = run_routes(app, iterations=args.iterations)
+    print_routes(routes)
+
+    report = build_report(sizes, routes)
+    if args.output:
+        save(report, args.output)
+    if args.baseline:
+        return check(load_report(args.baseline), report, args)
+
+def compare_command(args):
+    return check(load_report(args.baseline), load_report(args.current), args)
+
+def check(baseline, current, args):
+    problems = compare(baseline, current, tolerance=args.tolerance, latency=not args.ignore_latency)
+    for problem in problems:
+        print(f'REGRESSION {problem}')
+    return 1 if problems else 0
+
+def add_comparison_arguments(parser):
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative growth (0.25 = 25%%)')
+    parser.add_argument('--ignore-latency', action='store_true', help='compare only queries, status and memory')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=usage,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    routes = commands.add_parser('routes', help='time every route with the test client')
+    routes.add_argument('--users', type=int, default=200)
+    routes.add_argument('--posts-per-user', type=int, default=20)
+    routes.add_argument('--tags-per-post', type=int, default=3)
+    routes.add_argument('--tags', type=int, default=50)
+    routes.add_argument('--iterations', type=int, default=50)
+    routes.add_argument('--output', help='write the JSON report here')
+    routes.add_argument('--baseline', help='exit 1 if the run regresses against this report')
+    add_comparison_arguments(routes)
+    routes.set_defaults(run=routes_command)
+
+    diff = commands.add_parser('compare', help='compare two JSON reports')
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    add_comparison_arguments(diff)
+    diff.set_defaults(run=compare_command)
+
+    http = commands.add_parser('load', help='HTTP load against serve.py in sync and async modes')
+    load.add_arguments(http)
+    http.set_defaults(run=load.run)
+
+    listing = commands.add_parser('queries', help='listing queries at each table size')
+    listing.add_argument('sizes', type=int, nargs='*', default=[10000, 100000, 1000000])
+    listing.set_defaults(run=lambda args: queries.main(args.sizes))
+
+    startup = commands.add_parser('startup', help='app startup and first-request latency')
+    startup.set_defaults(run=lambda args: queries.bench_startup())
+
+    args = parser.parse_args(argv)
+    result = args.run(args)
+    return result if isinstance(result, int) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
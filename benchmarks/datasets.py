@@ -0,0 +1,85 @@
+"""Synthetic Blogly datasets of configurable size."""
+
+import os
+import random
+import tempfile
+from contextlib import contextmanager
+
+from app import create_app
+from cache import caches
+from jobs import jobs
+from config import Config
+from migrations import upgrade
+from models import db, User, Post, Tag, Post_Tag, recount_tags
+from search import search_index
+from feeds import rebuild_feeds
+
+BATCH = 10000
+POST_CONTENT = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 10
+WORDS = ['happy', 'days', 'garden', 'travel', 'python', 'coffee', 'music', 'winter', 'summer', 'notes']
+
+def make_app(path, **overrides):
+    """The full Blogly app on the SQLite file at `path`."""
+    return create_app(Config, SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}', SQLALCHEMY_ECHO=False,
+                      QUERY_STATS_ENABLED=False, **overrides)
+
+def insert(table, rows):
+    """executemany `rows` into `table` in batches, so huge datasets stay out of memory."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+def generate(users, posts_per_user, tags_per_post, tags=50, seed=0):
+    """Fill the current app's empty database; post n belongs to user (n - 1) // posts_per_user + 1."""
+    rng = random.Random(seed)
+    tags = max(tags, tags_per_post)
+    posts = users * posts_per_user
+
+    insert(User.__table__, ({'first_name': f'First{i}', 'last_name': f'Last{i}', 'image_url': ''} for i in range(users)))
+    insert(Tag.__table__, ({'name': f'Tag {i}'} for i in range(tags)))
+    insert(Post.__table__, ({'title': f'Post {i} about {rng.choice(WORDS)}', 'content': POST_CONTENT,
+                             'user_id': i // posts_per_user + 1} for i in range(posts)))
+    insert(Post_Tag.__table__, ({'post_id': post_id, 'tag_id': tag_id}
+                                for post_id in range(1, posts + 1)
+                                for tag_id in rng.sample(range(1, tags + 1), tags_per_post)))
+    recount_tags(list(range(1, tags + 1)))
+    rebuild_feeds(db.session)
+    db.session.commit()
+
+def reset_state():
+    """Forget cached pages and the fallback search index, which outlive any one database."""
+    for cache in caches.values():
+        cache.clear()
+    search_index.reset()
+
+@contextmanager
+def dataset(users, posts_per_user, tags_per_post, tags=50):
+    """An app context on a freshly generated temporary database, removed afterwards.
+
+    connect_db makes the newest app the default for code running outside an app
+    context, and db.session is scoped per thread rather than per app, so both are
+    put back afterwards for whatever else runs in this process.
+    """
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    previous_app = db.app
+    db.session.remove()
+    app = make_app(path)
+    try:
+        with app.app_context():
+            upgrade(db.engine, db.metadata)
+            generate(users, posts_per_user, tags_per_post, tags)
+            reset_state()
+            yield app
+            jobs.wait_idle(60)
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        db.app = previous_app
+        reset_state()
+        os.remove(path)
@@ -0,0 +1,112 @@
+"""HTTP load test comparing the sync and async (gevent) serving modes of serve.py.
+
+Seeds a throwaway SQLite database (or uses DATABASE_URL, e.g. a local Postgres),
+starts serve.py in each mode, and fires concurrent GETs at the read-only pages:
+
+    python -m benchmarks load --requests 2000 --concurrency 100 --db-latency 20
+
+--db-latency adds a simulated round trip to every statement, since a local SQLite
+file answers far faster than a database across the network.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.datasets import make_app, generate
+from benchmarks.routes import percentile
+from migrations import upgrade
+from models import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def read_urls(users):
+    return ['/users', '/users/1', '/users/1/post/1/Post', '/tags', '/tags/1', f'/users/{users // 2}']
+
+def seed_database(path, users):
+    with make_app(path).app_context():
+        upgrade(db.engine, db.metadata)
+        generate(users, posts_per_user=10, tags_per_post=3)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'server on port {port} did not start')
+
+def fetch(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=60) as response:
+        response.read()
+        status = response.status
+    return time.perf_counter() - start, status
+
+def run_load(base, urls, requests, concurrency):
+    targets = [base + urllib.request.quote(urls[i % len(urls)]) for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, targets))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status != 200)
+    return {'rps': round(requests / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'errors': errors}
+
+def run_mode(mode, env, args):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'serve.py'), '--mode', mode, '--port', str(port),
+               '--threads', str(args.threads), '--db-latency', str(args.db_latency)]
+    server = subprocess.Popen(command, env=env, cwd=ROOT)
+    try:
+        wait_for(port)
+        run_load(f'http://127.0.0.1:{port}', read_urls(args.users), min(args.requests, 50), args.concurrency)
+        return run_load(f'http://127.0.0.1:{port}', read_urls(args.users), args.requests, args.concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+
+def add_arguments(parser):
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100, help='concurrent clients')
+    parser.add_argument('--threads', type=int, default=8, help='request threads in sync mode')
+    parser.add_argument('--users', type=int, default=1000, help='users to seed, with 10 posts each')
+    parser.add_argument('--db-latency', type=float, default=0, help='simulated ms per statement')
+    parser.add_argument('--modes', default='sync,async')
+
+def run(args):
+    """{mode: throughput and latency percentiles} for each serving mode in args.modes."""
+    env = dict(os.environ)
+    path = None
+    if 'DATABASE_URL' not in env:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        seed_database(path, args.users)
+        env['DATABASE_URL'] = f'sqlite:///{path}'
+    try:
+        results = {}
+        print(f'{"mode":<6} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+        for mode in args.modes.split(','):
+            result = results[mode] = run_mode(mode, env, args)
+            print(f'{mode:<6} {result["rps"]:9.1f} {result["p50_ms"]:9.1f} {result["p95_ms"]:9.1f} '
+                  f'{result["p99_ms"]:9.1f} {result["errors"]:7d}')
+        return results
+    finally:
+        if path:
+            os.remove(path)
@@ -0,0 +1,105 @@
+"""Listing queries at growing table sizes, and worker startup time.
+
+    python -m benchmarks queries 10000 100000 1000000
+    python -m benchmarks startup
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy.orm import load_only
+from models import db, connect_db, User, Post
+from migrations import upgrade
+from pagination import keyset_page
+
+POST_CONTENT = 'x' * 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+    return app
+
+def seed(rows):
+    """Insert `rows` users, and rows / 10 posts all written by the first user."""
+    db.session.execute(User.__table__.insert(),
+                       [{'first_name': f'First{i}', 'last_name': f'Last{i}', 'image_url': ''} for i in range(rows)])
+    db.session.execute(Post.__table__.insert(),
+                       [{'title': f'Post {i}', 'content': POST_CONTENT, 'user_id': 1} for i in range(rows // 10)])
+    db.session.commit()
+
+def timed(fn, repeat=5):
+    """Best wall-clock time of `repeat` runs, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench(rows):
+    middle = rows // 2
+    results = {
+        'users: all()': timed(lambda: User.query.all()),
+        'users: keyset page': timed(lambda: keyset_page(
+            User.query.options(load_only('id', 'first_name', 'last_name')), User.id, after=middle)),
+        'user posts: all()': timed(lambda: Post.query.filter(Post.user_id == 1).all()),
+        'user posts: keyset page': timed(lambda: keyset_page(
+            Post.query.filter(Post.user_id == 1).options(load_only('id', 'title')), Post.id, after=middle // 10)),
+    }
+    for name, ms in results.items():
+        print(f'{rows:>9} rows  {name:<25} {ms:10.2f} ms')
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+from app import create_app
+app = create_app()
+ready = time.perf_counter()
+client = app.test_client()
+client.get('/users')
+first = time.perf_counter()
+client.get('/users')
+second = time.perf_counter()
+print(ready - start, first - ready, second - first)
+"""
+
+def bench_startup(runs=10):
+    """Time a fresh worker process: import + create_app, then its first and second requests."""
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        with make_app(path).app_context():
+            upgrade(db.engine, db.metadata)
+            seed(1000)
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+        timings = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, check=True,
+                                    capture_output=True, text=True, cwd=ROOT)
+            timings.append([float(value) * 1000 for value in output.stdout.split()])
+        for name, column in zip(['startup', 'first request', 'second request'], zip(*timings)):
+            print(f'{name:<15} median {sorted(column)[len(column) // 2]:8.2f} ms  max {max(column):8.2f} ms')
+    finally:
+        os.remove(path)
+
+def main(sizes):
+    for rows in sizes:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            with make_app(path).app_context():
+                db.create_all()
+                seed(rows)
+                bench(rows)
+                db.session.remove()
+        finally:
+            os.remove(path)
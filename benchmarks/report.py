@@ -0,0 +1,57 @@
+"""Machine-readable benchmark reports, and comparison against a stored baseline."""
+
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+def build_report(dataset, routes, load=None):
+    return {'meta': {'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'dataset': dataset},
+            'routes': routes,
+            'load': load or {}}
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(baseline, current, tolerance=0.25, min_ms=1.0, latency=True):
+    """Regressions of `current` against `baseline`, as readable lines.
+
+    Any increase in queries per request is a regression. Median latency and peak
+    memory regress when they grow by more than `tolerance`; latency must also grow
+    by at least `min_ms`, so fast routes do not flap on noise. The tail percentiles
+    are reported but not gated, being too noisy over a few dozen requests.
+    Pass latency=False when the two reports come from different machines.
+    """
+    problems = []
+    if baseline['meta'].get('dataset') != current['meta'].get('dataset'):
+        problems.append(f'dataset differs: {baseline["meta"].get("dataset")} vs {current["meta"].get("dataset")}')
+
+    for endpoint, old in sorted(baseline['routes'].items()):
+        new = current['routes'].get(endpoint)
+        if new is None:
+            problems.append(f'{endpoint}: missing from the current report')
+            continue
+        if new['status'] != old['status']:
+            problems.append(f'{endpoint}: status {old["status"]} -> {new["status"]}')
+        if new['queries'] > old['queries']:
+            problems.append(f'{endpoint}: queries {old["queries"]} -> {new["queries"]}')
+        if new['peak_kb'] > old['peak_kb'] * (1 + tolerance):
+            problems.append(f'{endpoint}: peak memory {old["peak_kb"]} KB -> {new["peak_kb"]} KB')
+        if latency and new['p50_ms'] > old['p50_ms'] * (1 + tolerance) and new['p50_ms'] - old['p50_ms'] >= min_ms:
+            problems.append(f'{endpoint}: p50 {old["p50_ms"]} ms -> {new["p50_ms"]} ms')
+    return problems
+
+def print_routes(routes, out=sys.stdout):
+    out.write(f'{"endpoint":<32} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"peak KB":>8}\n')
+    for endpoint, result in routes.items():
+        out.write(f'{endpoint:<32} {result["p50_ms"]:8.2f} {result["p95_ms"]:8.2f} {result["p99_ms"]:8.2f} '
+                  f'{result["queries"]:8d} {result["peak_kb"]:8.1f}\n')
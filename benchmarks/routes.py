@@ -0,0 +1,155 @@
+"""Per-route timings with the Flask test client.
+
+Every request is measured cold: the page, tag and compressed-response caches are
+emptied (untimed) before it, so the queries, latency and memory recorded are
+those of a request that does the work, whatever ran before it. The in-memory
+search index of the SQLite fallback lives as long as the process, like a
+database index, and is kept. Peak memory is traced after a full garbage
+collection, so it does not depend on the number of iterations either.
+"""
+
+import gc
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from cache import caches
+from models import db, User, Post, Tag
+
+# `prepare(n)` runs untimed before the n-th request and returns (path, form or JSON data).
+Case = namedtuple('Case', 'endpoint method prepare')
+
+def new_user():
+    user = User(first_name='Bench', last_name='Victim')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def new_post():
+    post = Post(title='Victim', content='To be deleted.', user_id=1)
+    db.session.add(post)
+    db.session.commit()
+    return post.id
+
+def new_tag(n):
+    tag = Tag(name=f'Victim {n}')
+    db.session.add(tag)
+    db.session.commit()
+    return tag.id
+
+CASES = [
+    Case('blogly.redirect_to_user_page', 'GET', lambda n: ('/', None)),
+    Case('blogly.user_list', 'GET', lambda n: ('/users', None)),
+    Case('blogly.show_user', 'GET', lambda n: ('/users/1', None)),
+    Case('blogly.show_post', 'GET', lambda n: ('/users/1/post/1/Post', None)),
+    Case('blogly.action_to_post', 'POST', lambda n: (f'/users/1/post/{new_post()}/Victim', {'ACTION': 'delete'})),
+    Case('blogly.edit_post', 'GET', lambda n: ('/users/1/post/1/Post/edit', None)),
+    Case('blogly.apply_form_changes', 'POST',
+         lambda n: ('/users/1/post/1/Post/edit', {'title': 'Post 0', 'content': 'Edited.', 'tag': ['1', '2']})),
+    Case('blogly.action_to_user', 'POST', lambda n: (f'/users/{new_user()}', {'ACTION': 'delete'})),
+    Case('blogly.edit_user', 'GET', lambda n: ('/users/1/edit', None)),
+    Case('blogly.new_post_form', 'GET', lambda n: ('/users/1/new-post', None)),
+    Case('blogly.submit_post', 'POST', lambda n: ('/users/1/new-post', {'title': f'New {n}', 'content': 'Hi', 'tag': ['1']})),
+    Case('blogly.apply_user_changes', 'POST',
+         lambda n: ('/users/1/edit', {'first_name': 'First0', 'last_name': 'Last0', 'image_url': ''})),
+    Case('blogly.create_user', 'POST', lambda n: ('/users', {'first_name': 'New', 'last_name': f'User {n}', 'image_url': ''})),
+    Case('blogly.site_feed', 'GET', lambda n: ('/feed', None)),
+    Case('blogly.user_posts_feed', 'GET', lambda n: ('/users/1/feed.atom', None)),
+    Case('blogly.tag_posts_feed', 'GET', lambda n: ('/tags/1/feed.rss', None)),
+    Case('blogly.search', 'GET', lambda n: ('/search?q=happy+days', None)),
+    Case('blogly.cache_stats', 'GET', lambda n: ('/cache/stats', None)),
+    Case('blogly.metrics', 'GET', lambda n: ('/metrics', None)),
+    Case('blogly.job_metrics', 'GET', lambda n: ('/jobs/metrics', None)),
+    Case('blogly.tag_list', 'GET', lambda n: ('/tags', None)),
+    Case('blogly.show_tag', 'GET', lambda n: ('/tags/1', None)),
+    Case('blogly.create_tag', 'POST', lambda n: ('/tags', {'tag_name': f'New tag {n}'})),
+    Case('blogly.action_to_tag', 'POST', lambda n: (f'/tags/{new_tag(n)}', {'ACTION': 'delete'})),
+    Case('blogly.edit_tag', 'GET', lambda n: ('/tags/1/edit', None)),
+    Case('blogly.apply_tag_changes', 'POST', lambda n: ('/tags/1/edit', {'tag_name': 'Tag 0'})),
+    Case('api.list_resources', 'GET', lambda n: ('/api/v1/posts?include=tags,user', None)),
+    Case('api.get_resource', 'GET', lambda n: ('/api/v1/users/1?include=posts', None)),
+    Case('api.batch', 'POST', lambda n: ('/api/v1/batch', {'operations': [
+        {'op': 'create', 'type': 'users', 'attributes': {'first_name': 'Api', 'last_name': f'User {n}'}},
+        {'op': 'create', 'type': 'posts', 'attributes': {'title': 'Api post', 'content': 'Hi', 'user_id': '$0'}}]})),
+]
+
+def uncovered_endpoints(app, cases=CASES):
+    """Endpoints of `app` that no case exercises, so new routes cannot slip out of the suite."""
+    covered = {case.endpoint for case in cases}
+    return sorted(rule.endpoint for rule in app.url_map.iter_rules()
+                  if rule.endpoint != 'static' and rule.endpoint not in covered)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def read(response):
+    """Read the whole body, so time spent rendering a streamed page is counted."""
+    response.get_data()
+    response.close()
+    return response
+
+def clear_caches():
+    for cache in caches.values():
+        cache.clear()
+
+def send(client, case, n):
+    path, data = case.prepare(n)
+    clear_caches()
+    if case.endpoint.startswith('api.') and case.method == 'POST':
+        return lambda: read(client.post(path, json=data))
+    return lambda: read(client.open(path, method=case.method, data=data))
+
+def run_case(client, case, iterations, warmup):
+    """Latency percentiles, median queries per request and peak allocation of one route."""
+    queries, counting = [], []
+    request_thread = threading.get_ident()
+    def count(conn, cursor, statement, parameters, context, executemany):
+        # Background job workers share the engine; only count the request's own statements.
+        if counting and threading.get_ident() == request_thread:
+            queries[-1] += 1
+
+    latencies, statuses = [], set()
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        for n in range(warmup + iterations):
+            request = send(client, case, n)
+            queries.append(0)
+            counting.append(True)
+            start = time.perf_counter()
+            response = request()
+            elapsed = time.perf_counter() - start
+            counting.pop()
+            if n >= warmup:
+                latencies.append(elapsed * 1000)
+                statuses.add(response.status_code)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    request = send(client, case, warmup + iterations)
+    gc.collect()
+    tracemalloc.start()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'method': case.method,
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'queries': sorted(queries[warmup:])[iterations // 2],
+            'peak_kb': round(peak / 1024, 1)}
+
+def run_routes(app, iterations=50, warmup=3, cases=CASES):
+    """{endpoint: measurements} for every case, run against the app's current database.
+
+    The GET cases run first, in order, so they all read the dataset as generated
+    rather than one grown by however many posts, users and tags the writes added.
+    """
+    client = app.test_client()
+    cases = sorted(cases, key=lambda case: case.method != 'GET')
+    return {case.endpoint: run_case(client, case, iterations, warmup) for case in cases}
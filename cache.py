@@ -0,0 +1,188 @@
+"""Process-local caches for Blogly, with an optional shared backend.
+
+Each Cache keeps an LRU of at most `maxsize` entries that expire after `ttl`
+seconds. Entries are stored under the cache's current generation; invalidating
+bumps the generation so every older entry misses from then on. Callers can also
+keep narrower generations per scope (say, one user's pages) and build them into
+their keys. When a shared backend is configured the generations live there, so a
+bump in one worker process invalidates the entries held by all the others.
+
+CACHE_BACKEND selects the shared backend of every cache when the app is created:
+None for process-local caches, a redis:// URL (needs the redis package), or any
+object with get/set/delete/incr such as DictBackend.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+caches = {}
+
+class DictBackend:
+    """In-memory stand-in for a shared key/value store such as memcached or Redis."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._data.get(key, (0, None))[0] + 1
+            self._data[key] = (value, None)
+            return value
+
+class RedisBackend:
+    """Shared backend on Redis; values are pickled, generation counters kept as integers."""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        if value.isdigit():
+            return int(value)
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+def make_backend(setting):
+    if setting is None or not isinstance(setting, str):
+        return setting
+    if setting.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(setting)
+    raise ValueError(f'unsupported CACHE_BACKEND {setting!r}')
+
+def init_caches(app):
+    """Give every cache the shared backend named by CACHE_BACKEND, or none."""
+    app.config.setdefault('CACHE_BACKEND', None)
+    backend = make_backend(app.config['CACHE_BACKEND'])
+    for cache in caches.values():
+        cache.backend = backend
+        cache.clear()
+
+class Cache:
+    """A TTL/LRU read-through cache invalidated by generation counters."""
+
+    def __init__(self, name, maxsize=1024, ttl=300, backend=None, clock=time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generations = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def generation(self, scope=''):
+        if self.backend is None:
+            return self._generations.get(scope, 0)
+        return self.backend.get(f'{self.name}:generation:{scope}') or 0
+
+    def bump(self, scope=''):
+        """Invalidate every entry of `scope` (or of the whole cache), in all processes sharing the backend."""
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+            if not scope:
+                self._entries.clear()
+        if self.backend is not None:
+            self.backend.incr(f'{self.name}:generation:{scope}')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key, default=None):
+        full_key = self._full_key(key)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[full_key]
+
+        if self.backend is not None:
+            value = self.backend.get(full_key)
+            if value is not None:
+                self._store(full_key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        full_key = self._full_key(key)
+        self._store(full_key, value)
+        if self.backend is not None:
+            self.backend.set(full_key, value, self.ttl)
+
+    def delete(self, key):
+        full_key = self._full_key(key)
+        with self._lock:
+            self._entries.pop(full_key, None)
+        if self.backend is not None:
+            self.backend.delete(full_key)
+
+    def get_or_set(self, key, load):
+        """Return the cached value for `key`, calling `load()` to fill it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+    def _full_key(self, key):
+        return f'{self.name}:{self.generation()}:{key}'
+
+    def _store(self, full_key, value):
+        with self._lock:
+            self._entries[full_key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+tag_cache = Cache('tags', maxsize=16, ttl=300)
+page_cache = Cache('pages', maxsize=1024, ttl=300)
@@ -0,0 +1,243 @@
+"""`flask blogly export` and `flask blogly import`: bulk NDJSON/CSV transfer of users, tags and posts.
+
+Both commands stream, so memory use does not grow with the size of the blog.
+Export reads through server-side cursors (yield_per). Import writes batches with
+one executemany per table, resolves each batch's tag names with one IN query, and
+records how many records it has committed in a checkpoint file, so an interrupted
+import picks up where it stopped when run again with the same --checkpoint. The
+checkpoint is written after the commit, so it can trail by a batch after a
+crash; a resumed import skips records whose ids are already in the database
+until it reaches one that is not.
+
+Records keep their ids, so import into an empty database. Export writes users,
+then tags, then posts, which is the order import needs.
+
+`flask blogly precompile` compiles every template into the template bytecode cache.
+`flask blogly rebuild-feeds` recreates the feed timelines from the posts table.
+"""
+
+import csv
+import json
+import os
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models import db, User, Post, Tag, Post_Tag, FeedEntry, recount_tags, invalidate_tags
+from search import search_index
+from feeds import refresh_feeds, rebuild_feeds
+from rendering import precompile_templates
+
+blogly = AppGroup('blogly', help='Blogly data and deployment commands.')
+
+FIELDS = {
+    'user': ['id', 'first_name', 'last_name', 'image_url', 'updated_at'],
+    'tag': ['id', 'name'],
+    'post': ['id', 'title', 'content', 'created_at', 'updated_at', 'user_id'],
+}
+CSV_COLUMNS = ['type', 'id', 'first_name', 'last_name', 'image_url', 'name',
+               'title', 'content', 'created_at', 'updated_at', 'user_id', 'tags']
+DATETIMES = {'created_at', 'updated_at'}
+INTEGERS = {'id', 'user_id'}
+TABLES = {'user': User.__table__, 'tag': Tag.__table__, 'post': Post.__table__}
+
+def export_records(batch_size):
+    """Every user, tag and post as a dict, read in batches of `batch_size` rows."""
+    for kind, model in (('user', User), ('tag', Tag)):
+        columns = [getattr(model, name) for name in FIELDS[kind]]
+        query = db.session.query(*columns).order_by(model.id).execution_options(stream_results=True)
+        for row in query.yield_per(batch_size):
+            yield dict(zip(FIELDS[kind], row), type=kind)
+
+    columns = [getattr(Post, name) for name in FIELDS['post']]
+    query = db.session.query(*columns).order_by(Post.id).execution_options(stream_results=True)
+    rows = iter(query.yield_per(batch_size))
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        tags = {}
+        tag_query = (db.session.query(Post_Tag.post_id, Tag.name)
+                     .join(Tag, Tag.id == Post_Tag.tag_id)
+                     .filter(Post_Tag.post_id.in_([row.id for row in batch])))
+        for post_id, name in tag_query:
+            tags.setdefault(post_id, []).append(name)
+        for row in batch:
+            yield dict(zip(FIELDS['post'], row), type='post', tags=sorted(tags.get(row.id, [])))
+
+def to_text(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def write_ndjson(records, out):
+    for record in records:
+        out.write(json.dumps({key: to_text(value) for key, value in record.items()}) + '\n')
+
+def write_csv(records, out):
+    writer = csv.DictWriter(out, CSV_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for record in records:
+        row = {key: to_text(value) for key, value in record.items()}
+        if 'tags' in row:
+            row['tags'] = '|'.join(row['tags'])
+        writer.writerow(row)
+
+def read_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+def read_csv(stream):
+    """Records from CSV rows; CSV cannot tell NULL from '', so empty text stays ''."""
+    for row in csv.DictReader(stream):
+        record = {key: value for key, value in row.items() if key in FIELDS[row['type']] + ['type']}
+        if row['type'] == 'post':
+            record['tags'] = [name for name in row['tags'].split('|') if name]
+        yield record
+
+def parse(record):
+    """Convert the text values of an imported record back to column types.
+
+    Nullable columns are always present, as None when the record has no value,
+    so records of one type share the same keys and batch into one executemany.
+    Missing values of NOT NULL columns are left out for the column default.
+    """
+    kind = record['type']
+    values = {}
+    for name in FIELDS[kind]:
+        value = record.get(name)
+        if value == '' and name in DATETIMES | INTEGERS:
+            value = None
+        if value is not None and name in DATETIMES:
+            value = datetime.fromisoformat(value)
+        elif value is not None and name in INTEGERS:
+            value = int(value)
+        if value is not None or TABLES[kind].c[name].nullable:
+            values[name] = value
+    return kind, values
+
+def existing_ids(kind, rows):
+    """Ids of the batch's records that are already in the database, with one IN query."""
+    ids = [values['id'] for values in rows if 'id' in values]
+    table = TABLES[kind]
+    return {row_id for (row_id,) in db.session.query(table.c.id).filter(table.c.id.in_(ids))} if ids else set()
+
+def import_batch(kind, rows):
+    """Insert one batch of same-type rows; returns the ids of tags whose post counts changed."""
+    if not rows:
+        return set()
+    if kind != 'post':
+        db.session.execute(TABLES[kind].insert(), rows)
+        return set()
+
+    tags = [(values['id'], name) for values in rows for name in values.pop('tags')]
+    db.session.execute(TABLES['post'].insert(), rows)
+    if not tags:
+        refresh_feeds((values['id'] for values in rows), new=True)
+        return set()
+    names = {name for _, name in tags}
+    tag_ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)))
+    missing = names - set(tag_ids)
+    if missing:
+        reset_sequences('tags')
+        db.session.execute(TABLES['tag'].insert(), [{'name': name} for name in missing])
+        tag_ids.update(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(missing)))
+    db.session.execute(Post_Tag.__table__.insert(),
+                       [{'post_id': post_id, 'tag_id': tag_ids[name]} for post_id, name in set(tags)])
+    refresh_feeds((values['id'] for values in rows), new=True)
+    return {tag_ids[name] for name in names}
+
+def reset_sequences(*tables):
+    """Move PostgreSQL id sequences past the imported ids."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in tables or ('users', 'tags', 'posts'):
+        db.session.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 1)) FROM {table}")
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    return 0
+
+def write_checkpoint(path, done):
+    if path:
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(str(done))
+        os.replace(f'{path}.tmp', path)
+
+@blogly.command('export')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--output', type=click.File('w'), default='-')
+@click.option('--batch-size', type=int, default=1000)
+def export_command(fmt, output, batch_size):
+    """Write every user, tag and post to OUTPUT."""
+    records = export_records(batch_size)
+    (write_csv if fmt == 'csv' else write_ndjson)(records, output)
+
+@blogly.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--batch-size', type=int, default=1000)
+@click.option('--checkpoint', type=click.Path(dir_okay=False), help='File recording progress, for resuming.')
+def import_command(source, fmt, batch_size, checkpoint):
+    """Load users, tags and posts from SOURCE, committing every BATCH_SIZE records."""
+    records = (read_csv if fmt == 'csv' else read_ndjson)(source)
+    done = read_checkpoint(checkpoint)
+    if done:
+        click.echo(f'Resuming after {done} records.', err=True)
+    records = islice(records, done, None)
+
+    batch, batch_kind, batch_keys = [], None, None
+    resuming = bool(done)
+
+    def flush():
+        nonlocal done, resuming
+        rows = batch
+        if resuming:
+            existing = existing_ids(batch_kind, batch)
+            rows = [values for values in batch if values.get('id') not in existing]
+            resuming = bool(existing)
+        tag_ids = import_batch(batch_kind, rows)
+        recount_tags(tag_ids)
+        db.session.commit()
+        done += len(batch)
+        write_checkpoint(checkpoint, done)
+        click.echo(f'{done} records imported', err=True)
+
+    for record in records:
+        kind, values = parse(record)
+        if kind == 'post':
+            values['tags'] = record.get('tags', [])
+        keys = values.keys()
+        if batch and (kind != batch_kind or keys != batch_keys or len(batch) >= batch_size):
+            flush()
+            batch = []
+        batch.append(values)
+        batch_kind, batch_keys = kind, keys
+    if batch:
+        flush()
+
+    reset_sequences()
+    db.session.commit()
+    invalidate_tags()
+    search_index.reset()
+    click.echo(f'Import finished: {done} records.', err=True)
+
+@blogly.command('precompile')
+def precompile_command():
+    """Compile every template into the bytecode cache, so workers start warm."""
+    bytecode_cache = current_app.jinja_env.bytecode_cache
+    if bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_CACHE is off.')
+    count = precompile_templates(current_app)
+    click.echo(f'Compiled {count} templates into {bytecode_cache.directory}.')
+
+@blogly.command('rebuild-feeds')
+def rebuild_feeds_command():
+    """Recreate every feed entry from the posts table."""
+    rebuild_feeds(db.session)
+    db.session.commit()
+    click.echo(f'Rebuilt {db.session.query(db.func.count(FeedEntry.id)).scalar()} feed entries.')
@@ -0,0 +1,87 @@
+"""Configuration for Blogly, read from the environment.
+
+    DATABASE_URL          database to connect to (postgresql:///blogly)
+    DATABASE_REPLICA_URLS comma-separated read replicas for GET requests (none)
+    SECRET_KEY            Flask secret key
+    SQLALCHEMY_ECHO       "1" to log every SQL statement
+    DB_POOL_SIZE          connections kept open per worker process (5)
+    DB_MAX_OVERFLOW       extra connections allowed under load (10)
+    DB_POOL_TIMEOUT       seconds to wait for a free connection (30)
+    DB_POOL_RECYCLE       seconds before a connection is replaced (1800)
+    DB_POOL_PRE_PING      "0" to skip checking connections on checkout
+    CACHE_BACKEND_URL     redis:// URL of a cache backend shared by all worker processes (none)
+    DELETE_IN_BACKGROUND  "1" to run user, post and tag deletes as background jobs
+    JOBS_DURABLE          "1" to keep background jobs in the jobs table instead of memory
+    JOBS_WORKERS          background job threads per process (2)
+    TEMPLATE_CACHE        "0" to keep compiled templates in memory only
+    TEMPLATE_CACHE_DIR    app-owned directory for compiled templates (Jinja's private per-user temp directory)
+    TEMPLATE_PRECOMPILE   "0" to compile templates on first use instead of at startup
+    METRICS_ENABLED       "0" to turn off request timing and the /metrics endpoint
+    PROFILE_TOKEN         value of an X-Blogly-Profile header that profiles a request (none)
+    PROFILE_SAMPLE_RATE   fraction of all requests to profile (0)
+    PROFILE_DIR           app-owned directory for profiles as .folded stacks (none: only counted in Server-Timing)
+"""
+
+import os
+
+from pagination import PAGE_SIZE
+
+def env_flag(name, default):
+    return os.environ.get(name, '1' if default else '0').lower() in ('1', 'true', 'yes', 'on')
+
+def engine_options(uri):
+    """Connection pool settings for `uri`; SQLite's pools take none of them.
+
+    create_app applies these to the final database URI unless the config or its
+    overrides set SQLALCHEMY_ENGINE_OPTIONS themselves.
+    """
+    if uri.startswith('sqlite'):
+        return {}
+    options = {'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True)}
+    if uri.startswith('postgres'):
+        # Batch executemany() into multi-row INSERT ... VALUES, for bulk imports.
+        options['executemany_mode'] = 'values'
+    return options
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///blogly')
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = env_flag('SQLALCHEMY_ECHO', False)
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'thisisacoolproject1000')
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+    PAGE_SIZE = PAGE_SIZE
+    SEARCH_PAGE_SIZE = 10
+    TAG_COUNTS_DENORMALIZED = True
+    TAG_CLOUD_SIZE = 50
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND_URL')
+    DELETE_BATCH_SIZE = 1000
+    DELETE_IN_BACKGROUND = env_flag('DELETE_IN_BACKGROUND', False)
+    JOBS_DURABLE = env_flag('JOBS_DURABLE', False)
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    TEMPLATE_CACHE = env_flag('TEMPLATE_CACHE', True)
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+    TEMPLATE_PRECOMPILE = env_flag('TEMPLATE_PRECOMPILE', True)
+    METRICS_ENABLED = env_flag('METRICS_ENABLED', True)
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+class TestConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'postgresql:///blogly_test')
+    SQLALCHEMY_ECHO = False
+    TESTING = True
+    SQLALCHEMY_REPLICA_URIS = []
+    CACHE_BACKEND = None
+    DELETE_IN_BACKGROUND = False
+    JOBS_EAGER = True
+    JOBS_DURABLE = False
+    TEMPLATE_CACHE = False
+    TEMPLATE_PRECOMPILE = False
+    PROFILE_TOKEN = None
+    PROFILE_SAMPLE_RATE = 0.0
+    DEBUG_TB_HOSTS = ['dont-show-debug-toolbar']
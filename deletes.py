@@ -0,0 +1,88 @@
+"""Deleting users, posts and tags in bounded batches.
+
+Rows are removed with bulk DELETE statements; the ON DELETE CASCADE foreign keys
+take the posts of a user, and the post_tags and feed_entries rows of a post or tag,
+with them, so no related object is ever loaded. A user's posts, and a tag's
+post_tags and feed entries, go in batches of DELETE_BATCH_SIZE, each committed on its own, so deleting a user with
+50k posts never holds one huge transaction and logs its progress as it goes.
+
+With DELETE_IN_BACKGROUND set, the routes enqueue the delete as a background job
+and return straight away.
+"""
+
+import logging
+
+from flask import current_app
+
+from models import db, User, Post, Tag, Post_Tag, FeedEntry, recount_tags, invalidate_tags, invalidate_user_pages
+from search import unindex_posts, unindex_user
+from jobs import job, jobs
+
+logger = logging.getLogger('blogly.deletes')
+
+DELETE_BATCH_SIZE = 1000
+
+def batch_size():
+    return current_app.config.get('DELETE_BATCH_SIZE', DELETE_BATCH_SIZE)
+
+def delete_post_batch(post_ids):
+    """Delete the posts and, by cascade, their post_tags rows; keeps tag counts right."""
+    tag_ids = {tag_id for (tag_id,) in db.session.query(Post_Tag.tag_id)
+               .filter(Post_Tag.post_id.in_(post_ids)).distinct()}
+    Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+    recount_tags(tag_ids)
+    db.session.commit()
+
+@job
+def delete_user(user_id):
+    """Delete a user's posts batch by batch, then the user. Returns the number of posts deleted."""
+    total = db.session.query(db.func.count(Post.id)).filter(Post.user_id == user_id).scalar()
+    done = 0
+    while True:
+        post_ids = [post_id for (post_id,) in db.session.query(Post.id).filter(Post.user_id == user_id).limit(batch_size())]
+        if not post_ids:
+            break
+        delete_post_batch(post_ids)
+        done += len(post_ids)
+        invalidate_user_pages(user_id)
+        logger.info('user %d: deleted %d/%d posts', user_id, done, total)
+
+    User.query.filter(User.id == user_id).delete(synchronize_session=False)
+    db.session.commit()
+    invalidate_user_pages(user_id)
+    unindex_user(user_id)
+    logger.info('user %d: deleted', user_id)
+    return done
+
+@job
+def delete_post(post_id, user_id):
+    delete_post_batch([post_id])
+    invalidate_user_pages(user_id)
+    unindex_posts([post_id])
+
+@job
+def delete_tag(tag_id):
+    """Unlink a tag from its posts batch by batch, then delete it. Returns the number of posts unlinked."""
+    done = 0
+    while True:
+        post_ids = [post_id for (post_id,) in db.session.query(Post_Tag.post_id)
+                    .filter(Post_Tag.tag_id == tag_id).limit(batch_size())]
+        if not post_ids:
+            break
+        Post_Tag.query.filter(Post_Tag.tag_id == tag_id, Post_Tag.post_id.in_(post_ids)).delete(synchronize_session=False)
+        FeedEntry.query.filter(FeedEntry.tag_id == tag_id, FeedEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        done += len(post_ids)
+        logger.info('tag %d: unlinked %d posts', tag_id, done)
+
+    Tag.query.filter(Tag.id == tag_id).delete(synchronize_session=False)
+    db.session.commit()
+    invalidate_tags()
+    return done
+
+def run_delete(delete, *args):
+    """Run `delete(*args)` now, or enqueue it as a job when DELETE_IN_BACKGROUND is set."""
+    if current_app.config.get('DELETE_IN_BACKGROUND'):
+        jobs.enqueue(delete.__name__, *args, key=f'{delete.__name__}:{args[0]}')
+    else:
+        delete(*args)
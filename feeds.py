@@ -0,0 +1,94 @@
+"""Timelines of the latest posts: the whole site, each author and each tag.
+
+Each post has one feed_entries row per timeline it appears in: 'all',
+'user:<author id>' and 'tag:<tag id>' for each of its tags. A row carries what a
+feed shows (title, summary, author, timestamps), and rows are indexed on
+(feed, created_at, post_id). A page of any timeline is then one range scan of
+that index, newest first, with keyset pagination on (created_at, post_id), no
+matter how many posts the site or the tag has.
+
+refresh_feeds rewrites the rows of the posts it is given with one INSERT ...
+SELECT, in the caller's transaction; the routes, the API and imports call it
+whenever they create or edit posts. Deleting a post, its author or a tag removes the rows through ON DELETE
+CASCADE. rebuild_feeds recreates every row from the posts table.
+"""
+
+from datetime import timezone
+from email.utils import format_datetime
+
+from sqlalchemy import bindparam, text
+
+from models import db, User, FeedEntry
+from pagination import PAGE_SIZE, timeline_page
+
+SITE_FEED = 'all'
+SUMMARY_LENGTH = 200
+
+def init_feeds(app):
+    app.add_template_filter(rfc3339)
+    app.add_template_filter(rfc822)
+
+def user_feed(user_id):
+    return f'user:{user_id}'
+
+def tag_feed(tag_id):
+    return f'tag:{tag_id}'
+
+def stored_timestamp(column, dialect):
+    """SQLite keeps timestamps as text; copy them in the format SQLAlchemy writes, so cursors compare equal."""
+    if dialect.name == 'sqlite':
+        return f"strftime('%Y-%m-%d %H:%M:%f', {column}) || '000'"
+    return column
+
+def copy_posts(dialect, only_some):
+    """INSERT ... SELECT of the feed entries of every post, or of the posts in :post_ids."""
+    where = 'WHERE posts.id IN :post_ids' if only_some else ''
+    columns = (f'posts.id, posts.user_id, posts.title, substr(posts.content, 1, {SUMMARY_LENGTH}), '
+               f'{stored_timestamp("posts.created_at", dialect)}, {stored_timestamp("posts.updated_at", dialect)}')
+    statement = text(f"""
+        INSERT INTO feed_entries (feed, tag_id, post_id, user_id, title, summary, created_at, updated_at)
+        SELECT '{SITE_FEED}', NULL, {columns} FROM posts {where}
+        UNION ALL
+        SELECT 'user:' || posts.user_id, NULL, {columns} FROM posts {where}
+        UNION ALL
+        SELECT 'tag:' || post_tags.tag_id, post_tags.tag_id, {columns}
+        FROM posts JOIN post_tags ON post_tags.post_id = posts.id {where}""")
+    if only_some:
+        statement = statement.bindparams(bindparam('post_ids', expanding=True))
+    return statement
+
+def refresh_feeds(post_ids, new=False):
+    """Rewrite the feed entries of the posts to match their current title, content and tags.
+
+    Pass new=True for posts just inserted, which have no entries to remove yet.
+    Posts that no longer exist just lose their entries. Nothing is committed, so
+    callers can save a post and its feed entries together.
+    """
+    post_ids = sorted(set(post_ids))
+    if not post_ids:
+        return
+    if not new:
+        FeedEntry.query.filter(FeedEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+    db.session.execute(copy_posts(db.engine.dialect, only_some=True), {'post_ids': post_ids})
+
+def rebuild_feeds(conn):
+    """Recreate every feed entry from the posts table, on a connection or session."""
+    dialect = conn.dialect if hasattr(conn, 'dialect') else conn.get_bind().dialect
+    conn.execute(FeedEntry.__table__.delete())
+    conn.execute(copy_posts(dialect, only_some=False))
+
+def feed_page(feed, after=None, before=None, per_page=PAGE_SIZE):
+    """One Page of a timeline, newest first, with each entry's author name."""
+    query = (db.session.query(FeedEntry.post_id, FeedEntry.user_id, FeedEntry.title, FeedEntry.summary,
+                              FeedEntry.created_at, FeedEntry.updated_at, User.first_name, User.last_name)
+             .join(User, User.id == FeedEntry.user_id)
+             .filter(FeedEntry.feed == feed))
+    return timeline_page(query, FeedEntry.created_at, FeedEntry.post_id, after=after, before=before, per_page=per_page)
+
+def rfc3339(value):
+    """Atom date format; timestamps are stored in UTC."""
+    return value.replace(tzinfo=timezone.utc).isoformat()
+
+def rfc822(value):
+    """RSS date format; timestamps are stored in UTC."""
+    return format_datetime(value.replace(tzinfo=timezone.utc))
@@ -0,0 +1,262 @@
+"""In-process background jobs, with an optional durable queue in the database.
+
+    @job
+    def reindex_post(post_id):
+        ...
+
+    jobs.enqueue('reindex_post', post.id, key=f'reindex_post:{post.id}')
+
+Jobs run on JOBS_WORKERS daemon threads, started by the first enqueue, each job
+inside its own app context. By default the queue lives in memory and is lost with
+the process. With JOBS_DURABLE set, jobs are rows of the `jobs` table instead:
+they survive restarts, any process of the app can run them, and workers claim a
+row with a conditional UPDATE that only one of them can win. No broker is needed.
+
+A failing job is retried up to JOBS_MAX_ATTEMPTS times in all, JOBS_RETRY_DELAY
+seconds later, doubling each time. Enqueueing with the key of a job that is still
+waiting to run does nothing, so a burst of edits to one post reindexes it once.
+Arguments must be JSON-serializable. JOBS_EAGER runs each job inline at enqueue,
+for tests.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, Job
+
+logger = logging.getLogger('blogly.jobs')
+
+handlers = {}
+
+def job(fn):
+    """Register `fn` as a job handler under its name."""
+    handlers[fn.__name__] = fn
+    return fn
+
+def init_jobs(app):
+    app.config.setdefault('JOBS_EAGER', False)
+    app.config.setdefault('JOBS_DURABLE', False)
+    app.config.setdefault('JOBS_WORKERS', 2)
+    app.config.setdefault('JOBS_MAX_ATTEMPTS', 3)
+    app.config.setdefault('JOBS_RETRY_DELAY', 1.0)
+    app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOBS_STALE_AFTER', 300)
+
+class PendingJob:
+    """A job taken off the queue by a worker; `id` is the jobs row id in durable mode."""
+
+    def __init__(self, name, args, key=None, attempts=0, enqueued_at=None, app=None, id=None):
+        self.name = name
+        self.args = args
+        self.key = key
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at or datetime.utcnow()
+        self.app = app
+        self.id = id
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {'p50': round(ordered[len(ordered) // 2], 3),
+            'p95': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+            'max': round(ordered[-1], 3)}
+
+class JobQueue:
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.pending = []  # in-memory mode: heap of (monotonic run time, sequence, PendingJob)
+        self.keys = set()
+        self.sequence = itertools.count()
+        self.workers = []
+        self.app = None
+        self.running = 0
+        self.counts = dict.fromkeys(['enqueued', 'duplicates', 'succeeded', 'retried', 'failed'], 0)
+        self.wait_ms = deque(maxlen=1000)
+        self.run_ms = deque(maxlen=1000)
+
+    def enqueue(self, name, *args, key=None, delay=0):
+        """Queue handler `name` to run with `args` in `delay` seconds; returns False if a job with `key` is already waiting."""
+        if name not in handlers:
+            raise KeyError(f'no job handler named {name!r}')
+        app = current_app._get_current_object()
+        self.counts['enqueued'] += 1
+
+        if app.config['JOBS_EAGER']:
+            self.execute(PendingJob(name, list(args), key, attempts=1, app=app))
+            return True
+
+        now = datetime.utcnow()
+        if app.config['JOBS_DURABLE']:
+            waiting = Job.query.filter(Job.key == key, Job.status == 'queued')
+            if key is not None and db.session.query(waiting.exists()).scalar():
+                self.counts['duplicates'] += 1
+                return False
+            db.session.add(Job(name=name, args=json.dumps(list(args)), key=key, created_at=now,
+                               run_at=now + timedelta(seconds=delay)))
+            db.session.commit()
+        else:
+            with self.changed:
+                if key is not None and key in self.keys:
+                    self.counts['duplicates'] += 1
+                    return False
+                self.push(PendingJob(name, list(args), key, enqueued_at=now, app=app), delay)
+
+        self.start(app)
+        with self.changed:
+            self.changed.notify()
+        return True
+
+    def push(self, pending, delay):
+        """Add to the in-memory queue; the caller holds `changed`."""
+        heapq.heappush(self.pending, (time.monotonic() + delay, next(self.sequence), pending))
+        if pending.key is not None:
+            self.keys.add(pending.key)
+
+    def start(self, app):
+        with self.changed:
+            if self.workers:
+                return
+            self.app = app
+            for number in range(app.config['JOBS_WORKERS']):
+                worker = threading.Thread(target=self.work, name=f'blogly-jobs-{number}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        while True:
+            pending = self.next_job()
+            try:
+                with pending.app.app_context():
+                    self.execute(pending)
+            except Exception:
+                logger.exception('job worker error')
+            finally:
+                with self.changed:
+                    self.running -= 1
+                    self.changed.notify_all()
+
+    def next_job(self):
+        """Block until a job is due, and mark it running."""
+        while True:
+            if self.app.config['JOBS_DURABLE']:
+                with self.app.app_context():
+                    pending = self.claim()
+                if pending:
+                    with self.changed:
+                        self.running += 1
+                    return pending
+                with self.changed:
+                    self.changed.wait(self.app.config['JOBS_POLL_INTERVAL'])
+                continue
+
+            with self.changed:
+                if self.pending and self.pending[0][0] <= time.monotonic():
+                    _, _, pending = heapq.heappop(self.pending)
+                    self.keys.discard(pending.key)
+                    pending.attempts += 1
+                    self.running += 1
+                    return pending
+                self.changed.wait(self.pending[0][0] - time.monotonic() if self.pending else None)
+
+    def claim(self):
+        """Take the next due row of the jobs table, or a running one abandoned by a dead worker."""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.app.config['JOBS_STALE_AFTER'])
+        due = db.or_(db.and_(Job.status == 'queued', Job.run_at <= now),
+                     db.and_(Job.status == 'running', Job.started_at < stale))
+        for (job_id,) in db.session.query(Job.id).filter(due).order_by(Job.run_at).limit(10).all():
+            won = Job.query.filter(Job.id == job_id, due).update(
+                {Job.status: 'running', Job.started_at: now, Job.attempts: Job.attempts + 1},
+                synchronize_session=False)
+            db.session.commit()
+            if won:
+                row = Job.query.get(job_id)
+                return PendingJob(row.name, json.loads(row.args), row.key, row.attempts, row.created_at, self.app, row.id)
+        db.session.commit()
+        return None
+
+    def execute(self, pending):
+        """Run one attempt of a job in the current app context and record the outcome."""
+        config = pending.app.config
+        self.wait_ms.append((datetime.utcnow() - pending.enqueued_at).total_seconds() * 1000)
+        start = time.perf_counter()
+        try:
+            handlers[pending.name](*pending.args)
+        except Exception as error:
+            db.session.rollback()
+            if config['JOBS_EAGER']:
+                self.counts['failed'] += 1
+                raise
+            self.retry_or_fail(pending, error)
+            return
+        finally:
+            self.run_ms.append((time.perf_counter() - start) * 1000)
+
+        self.counts['succeeded'] += 1
+        if pending.id is not None:
+            Job.query.filter(Job.id == pending.id).update(
+                {Job.status: 'done', Job.finished_at: datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+
+    def retry_or_fail(self, pending, error):
+        config = pending.app.config
+        if pending.attempts < config['JOBS_MAX_ATTEMPTS']:
+            self.counts['retried'] += 1
+            delay = config['JOBS_RETRY_DELAY'] * 2 ** (pending.attempts - 1)
+            logger.warning('job %s%r failed (attempt %d), retrying in %.1fs: %s',
+                           pending.name, tuple(pending.args), pending.attempts, delay, error)
+            values = {Job.status: 'queued', Job.run_at: datetime.utcnow() + timedelta(seconds=delay)}
+        else:
+            self.counts['failed'] += 1
+            logger.error('job %s%r failed after %d attempts', pending.name, tuple(pending.args),
+                         pending.attempts, exc_info=error)
+            values = {Job.status: 'failed', Job.finished_at: datetime.utcnow()}
+
+        if pending.id is not None:
+            values[Job.last_error] = repr(error)
+            Job.query.filter(Job.id == pending.id).update(values, synchronize_session=False)
+            db.session.commit()
+        elif values[Job.status] == 'queued':
+            with self.changed:
+                self.push(pending, delay)
+                self.changed.notify()
+
+    def wait_idle(self, timeout=None):
+        """Wait until the in-memory queue is empty and no job is running; True if it got there in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.changed:
+            while self.pending or self.running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.changed.wait(remaining)
+        return True
+
+    def metrics(self):
+        """Queue depth, outcome counters and wait/run latency of recent jobs, for the current app."""
+        config = current_app.config
+        if config['JOBS_DURABLE']:
+            by_status = dict(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status))
+            queued = by_status.get('queued', 0)
+        else:
+            by_status = None
+            queued = len(self.pending)
+        return {'mode': 'eager' if config['JOBS_EAGER'] else 'durable' if config['JOBS_DURABLE'] else 'memory',
+                'workers': len(self.workers),
+                'queued': queued,
+                'running': self.running,
+                'jobs_by_status': by_status,
+                **self.counts,
+                'wait_ms': percentiles(list(self.wait_ms)),
+                'run_ms': percentiles(list(self.run_ms))}
+
+jobs = JobQueue()
@@ -0,0 +1,167 @@
+"""Runtime metrics for Blogly in the Prometheus text format, served at /metrics.
+
+    blogly_http_request_duration_seconds  histogram per method, endpoint and status
+    blogly_http_requests_in_flight        requests being handled right now
+    blogly_db_pool_*                      connections per engine: size, checked out, overflow
+    blogly_cache_*                        hits, misses, evictions, size and hit ratio per cache
+    blogly_jobs_*                         background job queue depth and outcomes
+    blogly_replica_reads_total            GET requests that read from a replica, the primary, or fell back
+
+A request is timed until its response has been sent, so streamed pages count
+their rendering too. Metrics are kept per process: with several gunicorn
+workers, scrape each one, or read them as samples of the whole.
+"""
+
+import threading
+import time
+
+from flask import Response, current_app, g, request
+
+from cache import caches
+from jobs import jobs
+from models import db
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Observations bucketed per label set, e.g. request durations per route."""
+
+    def __init__(self, name, help, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # label values: [count per bucket..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.setdefault(label_values, [0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def lines(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self.lock:
+            series = sorted((values, list(counts)) for values, counts in self.series.items())
+        for label_values, counts in series:
+            labels = list(zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{format_labels(labels + [("le", bound)])} {count}'
+            yield f'{self.name}_bucket{format_labels(labels + [("le", "+Inf")])} {counts[-2]}'
+            yield f'{self.name}_count{format_labels(labels)} {counts[-2]}'
+            yield f'{self.name}_sum{format_labels(labels)} {format_value(counts[-1])}'
+
+def metric(name, kind, help, samples):
+    """Exposition lines of a gauge or counter from (labels, value) pairs."""
+    yield f'# HELP {name} {help}'
+    yield f'# TYPE {name} {kind}'
+    for labels, value in samples:
+        yield f'{name}{format_labels(labels)} {format_value(value)}'
+
+request_duration = Histogram('blogly_http_request_duration_seconds',
+                             'Time from the start of a request until its response is sent.',
+                             ('method', 'endpoint', 'status'))
+in_flight = 0
+in_flight_lock = threading.Lock()
+
+def init_metrics(app):
+    """Time every request of `app`; register this before other request hooks so aborted requests count too."""
+    app.config.setdefault('METRICS_ENABLED', True)
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    @app.before_request
+    def start_request_timer():
+        global in_flight
+        g.metrics_started = time.perf_counter()
+        with in_flight_lock:
+            in_flight += 1
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def observe_request(error=None):
+        global in_flight
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        with in_flight_lock:
+            in_flight -= 1
+        request_duration.observe(time.perf_counter() - started, request.method,
+                                 request.endpoint or 'none', g.pop('metrics_status', 500))
+
+def engines(app):
+    """(bind name, engine) of the primary database and every bind of `app`."""
+    yield 'primary', db.get_engine(app)
+    for bind in app.config.get('SQLALCHEMY_BINDS') or {}:
+        yield bind, db.get_engine(app, bind=bind)
+
+def pool_lines(app):
+    stats = {'size': [], 'checked_out': [], 'overflow': []}
+    for bind, engine in engines(app):
+        pool = engine.pool
+        # Only QueuePool keeps counts; SQLite's NullPool and SingletonThreadPool have nothing to report.
+        if not hasattr(pool, 'checkedout'):
+            continue
+        labels = [('bind', bind)]
+        stats['size'].append((labels, pool.size()))
+        stats['checked_out'].append((labels, pool.checkedout()))
+        stats['overflow'].append((labels, max(pool.overflow(), 0)))
+    yield from metric('blogly_db_pool_size', 'gauge', 'Connections the pool keeps open.', stats['size'])
+    yield from metric('blogly_db_pool_checked_out', 'gauge', 'Connections in use by requests or jobs.', stats['checked_out'])
+    yield from metric('blogly_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.', stats['overflow'])
+
+def cache_lines():
+    stats = {name: cache.stats() for name, cache in sorted(caches.items())}
+    for key, kind, help in [('hits', 'counter', 'Cache lookups that found an entry.'),
+                            ('misses', 'counter', 'Cache lookups that found nothing.'),
+                            ('evictions', 'counter', 'Entries dropped to stay under the size limit.'),
+                            ('size', 'gauge', 'Entries held in this process.'),
+                            ('hit_ratio', 'gauge', 'Hits over lookups since the process started.')]:
+        name = f'blogly_cache_{key}_total' if kind == 'counter' else f'blogly_cache_{key}'
+        yield from metric(name, kind, help, [([('cache', cache)], values[key]) for cache, values in stats.items()])
+
+def job_lines():
+    stats = jobs.metrics()
+    yield from metric('blogly_jobs_queued', 'gauge', 'Background jobs waiting to run.', [([], stats['queued'])])
+    yield from metric('blogly_jobs_running', 'gauge', 'Background jobs running now.', [([], stats['running'])])
+    yield from metric('blogly_jobs_total', 'counter', 'Background jobs by outcome.',
+                      [([('outcome', outcome)], stats[outcome])
+                       for outcome in ('enqueued', 'duplicates', 'succeeded', 'retried', 'failed')])
+
+def replica_lines(app):
+    replicas = app.extensions.get('blogly_replicas')
+    counts = replicas.counts if replicas is not None else {}
+    yield from metric('blogly_replica_reads_total', 'counter', 'GET requests by where their reads went.',
+                      [([('target', target)], count) for target, count in sorted(counts.items())])
+
+def render_metrics():
+    """Every metric of the current app, as a Prometheus text exposition response."""
+    app = current_app._get_current_object()
+    lines = [*request_duration.lines(),
+             *metric('blogly_http_requests_in_flight', 'gauge', 'Requests being handled now.', [([], in_flight)]),
+             *pool_lines(app),
+             *cache_lines(),
+             *job_lines(),
+             *replica_lines(app)]
+    return Response('\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
@@ -0,0 +1,112 @@
+"""Versioned schema migrations for Blogly.
+
+The schema version lives in a one-row `schema_version` table. A database without
+one is either brand new, in which case the current models are created with
+create_all and stamped at the latest version, or was made by an older create_all,
+in which case every migration is applied in order. Each migration runs in its own
+transaction together with the version bump.
+"""
+
+import logging
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db, Job, FeedEntry, POST_SEARCH_DDL
+from feeds import rebuild_feeds
+
+logger = logging.getLogger('blogly.migrations')
+
+def _add_updated_at(conn):
+    default = 'now()' if conn.dialect.name == 'postgresql' else "'1970-01-01 00:00:00'"
+    for table in ('users', 'posts'):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT {default}'))
+    conn.execute(text('UPDATE posts SET updated_at = created_at'))
+
+def _add_search_vector(conn):
+    if conn.dialect.name == 'postgresql':
+        for statement in POST_SEARCH_DDL:
+            conn.execute(text(statement))
+
+def _create_jobs(conn):
+    Job.__table__.create(conn, checkfirst=True)
+
+def _create_feed_entries(conn):
+    FeedEntry.__table__.create(conn, checkfirst=True)
+    rebuild_feeds(conn)
+
+MIGRATIONS = [
+    (1, 'add updated_at to users and posts', [
+        _add_updated_at,
+    ]),
+    (2, 'index posts by author, post_tags by tag and tags by lower-cased name', [
+        'CREATE INDEX IF NOT EXISTS ix_posts_user_id_created_at ON posts (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_post_tags_tag_id_post_id ON post_tags (tag_id, post_id)',
+        'CREATE INDEX IF NOT EXISTS ix_tags_name_lower ON tags (lower(name))',
+    ]),
+    (3, 'add a full-text search_vector column with a GIN index to posts (PostgreSQL only)', [
+        _add_search_vector,
+    ]),
+    (4, 'add a denormalized post_count to tags', [
+        'ALTER TABLE tags ADD COLUMN post_count INTEGER NOT NULL DEFAULT 0',
+        'UPDATE tags SET post_count = (SELECT count(*) FROM post_tags WHERE post_tags.tag_id = tags.id)',
+    ]),
+    (5, 'add the jobs table for the durable job queue', [
+        _create_jobs,
+    ]),
+    (6, 'add the feed_entries timelines, filled from the existing posts', [
+        _create_feed_entries,
+    ]),
+    (7, 'index tags by post_count for the tag cloud', [
+        'CREATE INDEX IF NOT EXISTS ix_tags_post_count_id ON tags (post_count, id)',
+    ]),
+    (8, "index posts by (author, id), the order of a user's keyset-paged post list", [
+        'CREATE INDEX IF NOT EXISTS ix_posts_user_id_id ON posts (user_id, id)',
+        'DROP INDEX IF EXISTS ix_posts_user_id_created_at',
+    ]),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+def current_version(conn):
+    """The schema version of the database, or None if it has never been versioned."""
+    if not conn.dialect.has_table(conn, 'schema_version'):
+        return None
+    return conn.execute(text('SELECT version FROM schema_version')).scalar()
+
+def upgrade(engine, metadata):
+    """Bring the database up to the latest schema version and return that version."""
+    with engine.begin() as conn:
+        version = current_version(conn)
+        if version is None:
+            fresh = not conn.dialect.has_table(conn, 'users')
+            conn.execute(text('CREATE TABLE schema_version (version INTEGER NOT NULL)'))
+            if fresh:
+                metadata.create_all(bind=conn)
+                conn.execute(text('INSERT INTO schema_version (version) VALUES (:v)'), v=HEAD)
+                logger.info('created schema at version %d', HEAD)
+                return HEAD
+            conn.execute(text('INSERT INTO schema_version (version) VALUES (0)'))
+            version = 0
+
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(text('UPDATE schema_version SET version = :v'), v=number)
+        logger.info('migrated schema to version %d: %s', number, description)
+        version = number
+    return version
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create or migrate the database schema to the latest version."""
+    version = upgrade(db.engine, db.metadata)
+    click.echo(f'Database schema is at version {version}.')
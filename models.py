@@ -1,12 +1,25 @@
 """Models for Blogly."""
-from flask_sqlalchemy import SQLAlchemy
+import sqlite3
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy.engine import Engine
+from cache import tag_cache, page_cache
+from replicas import RoutingSQLAlchemy, read_from_primary
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 def connect_db(app):
     db.app = app
     db.init_app(app)
 
+@db.event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked per connection."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -24,8 +37,14 @@ class User(db.Model):
                           nullable=False,
                           default='https://cdn.pixabay.com/photo/2015/10/05/22/37/blank-profile-picture-973460_960_720.png')
 
+    updated_at = db.Column(db.DateTime,
+                           nullable=False,
+                           default=db.func.now(),
+                           onupdate=db.func.now())
+
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (db.Index('ix_posts_user_id_id', 'user_id', 'id'),)
 
     id = db.Column(db.Integer,
                    primary_key=True,
@@ -41,14 +60,22 @@ class Post(db.Model):
                            nullable=False,
                            default=db.func.now())
 
+    updated_at = db.Column(db.DateTime,
+                           nullable=False,
+                           default=db.func.now(),
+                           onupdate=db.func.now())
+
     user_id = db.Column(db.Integer,
                         db.ForeignKey('users.id',
                                       ondelete='CASCADE'),
                         nullable=False)
     
-    user = db.relationship('User', backref='posts')
+    # passive_deletes leaves removing posts and post_tags rows to the ON DELETE CASCADE
+    # foreign keys, instead of loading every related object into the session first.
+    user = db.relationship('User', backref=db.backref('posts', passive_deletes=True))
 
-    tags = db.relationship('Tag', secondary='post_tags', backref='posts')
+    tags = db.relationship('Tag', secondary='post_tags', passive_deletes=True,
+                           backref=db.backref('posts', passive_deletes=True))
 
 class Tag(db.Model):
     __tablename__ = 'tags'
@@ -60,11 +87,28 @@ class Tag(db.Model):
     name = db.Column(db.String,
                      nullable=False,
                      unique=True)
-    
-   
+
+    post_count = db.Column(db.Integer,
+                           nullable=False,
+                           default=0,
+                           server_default='0')
+
+db.Index('ix_tags_name_lower', db.func.lower(Tag.name))
+db.Index('ix_tags_post_count_id', Tag.post_count, Tag.id)
+
+POST_SEARCH_DDL = [
+    """ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+           setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED""",
+    'CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector)',
+]
+
+for statement in POST_SEARCH_DDL:
+    db.event.listen(Post.__table__, 'after_create', db.DDL(statement).execute_if(dialect='postgresql'))
 
 class Post_Tag(db.Model):
     __tablename__ = 'post_tags'
+    __table_args__ = (db.Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id'),)
     
     post_id = db.Column(db.Integer, db.ForeignKey(
         'posts.id', ondelete='CASCADE'), primary_key=True)
@@ -72,17 +116,179 @@ class Post_Tag(db.Model):
     tag_id = db.Column(db.Integer, db.ForeignKey(
         'tags.id', ondelete='CASCADE'), primary_key=True)
 
+class Job(db.Model):
+    """A background job in the durable queue (JOBS_DURABLE); see jobs.py."""
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+                      db.Index('ix_jobs_key', 'key'))
+
+    id = db.Column(db.Integer,
+                   primary_key=True,
+                   autoincrement=True)
+
+    name = db.Column(db.String,
+                     nullable=False)
+
+    args = db.Column(db.Text,
+                     nullable=False,
+                     default='[]')
+
+    key = db.Column(db.String)
+
+    status = db.Column(db.String,
+                       nullable=False,
+                       default='queued')
+
+    attempts = db.Column(db.Integer,
+                         nullable=False,
+                         default=0)
+
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime,
+                           nullable=False)
+
+    run_at = db.Column(db.DateTime,
+                       nullable=False)
+
+    started_at = db.Column(db.DateTime)
+
+    finished_at = db.Column(db.DateTime)
+
+class FeedEntry(db.Model):
+    """A post's place in one timeline: the whole site ('all'), an author ('user:<id>') or a tag ('tag:<id>'); see feeds.py."""
+    __tablename__ = 'feed_entries'
+    __table_args__ = (db.UniqueConstraint('post_id', 'feed'),
+                      db.Index('ix_feed_entries_feed_created_at_post_id', 'feed', 'created_at', 'post_id'),
+                      db.Index('ix_feed_entries_tag_id_post_id', 'tag_id', 'post_id'))
+
+    id = db.Column(db.Integer,
+                   primary_key=True,
+                   autoincrement=True)
+
+    feed = db.Column(db.String,
+                     nullable=False)
+
+    post_id = db.Column(db.Integer,
+                        db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        nullable=False)
+
+    # Set on 'tag:<id>' entries only, so deleting the tag takes its timeline with it.
+    tag_id = db.Column(db.Integer,
+                       db.ForeignKey('tags.id', ondelete='CASCADE'))
+
+    user_id = db.Column(db.Integer,
+                        nullable=False)
+
+    title = db.Column(db.String,
+                      nullable=False)
+
+    summary = db.Column(db.String)
+
+    created_at = db.Column(db.DateTime,
+                           nullable=False)
+
+    updated_at = db.Column(db.DateTime,
+                           nullable=False)
+
+
+TagRow = namedtuple('TagRow', ['id', 'name'])
+
+def all_tags():
+    """Every tag as (id, name) rows ordered by id, served from the tag cache and filled from the primary."""
+    def load():
+        read_from_primary()
+        return [TagRow(*row) for row in db.session.query(Tag.id, Tag.name).order_by(Tag.id)]
+    return tag_cache.get_or_set('all', load)
+
+def invalidate_tags():
+    """Drop cached tag lists, and the pages showing tag names, after tags are created, renamed or deleted."""
+    tag_cache.bump()
+    page_cache.bump()
+
+def invalidate_user_pages(user_id):
+    """Drop the cached user page and post pages of a user, and the cached feeds, after the user or any of their posts change."""
+    page_cache.bump(f'user:{user_id}')
+    page_cache.bump('feeds')
 
 def check_if_users_post(user_id=int, post_id=int):
-    posts = User.query.get_or_404(user_id).posts
-    for post in posts:
-        if post.id == post_id:
-            return True
-    return False
+    """True if the post exists and belongs to the user, as a single EXISTS query."""
+    query = Post.query.filter(Post.id == post_id, Post.user_id == user_id)
+    return db.session.query(query.exists()).scalar()
 
 def tag_in_posts_by_ids(tag_id, post_id):
-    posts_with_tag = Tag.query.get(tag_id).posts
-    for x in posts_with_tag:
-        if x.id == post_id:
-            return True
-    return False
\ No newline at end of file
+    """True if the post carries the tag, looked up by the post_tags primary key."""
+    query = Post_Tag.query.filter(Post_Tag.post_id == post_id, Post_Tag.tag_id == tag_id)
+    return db.session.query(query.exists()).scalar()
+
+def set_post_tags(post, tag_ids, touch=True):
+    """Make `tag_ids` the post's tags, inserting and deleting only the post_tags rows that change.
+
+    Unknown tag ids are ignored. The post_count of each added or removed tag is
+    adjusted in the same transaction, and when anything changes the post's
+    updated_at moves too, so Last-Modified follows tag edits; pass touch=False for
+    a post inserted in the same transaction. The post must already have an id (flush
+    first); nothing is committed, so callers can save the post and its tags together.
+    """
+    wanted = set()
+    if tag_ids:
+        wanted = {tag_id for (tag_id,) in db.session.query(Tag.id).filter(Tag.id.in_(set(tag_ids)))}
+    current = {tag_id for (tag_id,) in db.session.query(Post_Tag.tag_id).filter(Post_Tag.post_id == post.id)}
+
+    removed = current - wanted
+    added = wanted - current
+    if removed:
+        Post_Tag.query.filter(Post_Tag.post_id == post.id,
+                              Post_Tag.tag_id.in_(removed)).delete(synchronize_session=False)
+        Tag.query.filter(Tag.id.in_(removed)).update({Tag.post_count: Tag.post_count - 1}, synchronize_session=False)
+    if added:
+        db.session.execute(Post_Tag.__table__.insert(),
+                           [{'post_id': post.id, 'tag_id': tag_id} for tag_id in added])
+        Tag.query.filter(Tag.id.in_(added)).update({Tag.post_count: Tag.post_count + 1}, synchronize_session=False)
+    if touch and (removed or added):
+        Post.query.filter(Post.id == post.id).update({Post.updated_at: db.func.now()}, synchronize_session=False)
+        db.session.expire(post, ['tags', 'updated_at'])
+        return
+    db.session.expire(post, ['tags'])
+
+def tag_ids_for_posts(*criteria):
+    """Ids of the tags on every post matching `criteria`, e.g. before those posts are deleted."""
+    query = db.session.query(Post_Tag.tag_id).join(Post, Post.id == Post_Tag.post_id).filter(*criteria).distinct()
+    return {tag_id for (tag_id,) in query}
+
+def recount_tags(tag_ids):
+    """Recompute the denormalized post_count of the given tags from post_tags."""
+    if tag_ids:
+        count = db.session.query(db.func.count(Post_Tag.post_id)).filter(Post_Tag.tag_id == Tag.id).as_scalar()
+        Tag.query.filter(Tag.id.in_(tag_ids)).update({Tag.post_count: count}, synchronize_session=False)
+
+def tag_post_counts(tag_ids):
+    """{tag id: number of posts} for the given tags that have posts.
+
+    Reads the denormalized tags.post_count column when TAG_COUNTS_DENORMALIZED is
+    set, and otherwise aggregates their post_tags rows with a single GROUP BY.
+    """
+    tag_ids = set(tag_ids)
+    if not tag_ids:
+        return {}
+    if current_app.config.get('TAG_COUNTS_DENORMALIZED', True):
+        query = db.session.query(Tag.id, Tag.post_count).filter(Tag.id.in_(tag_ids), Tag.post_count > 0)
+    else:
+        query = (db.session.query(Post_Tag.tag_id, db.func.count(Post_Tag.post_id))
+                 .filter(Post_Tag.tag_id.in_(tag_ids)).group_by(Post_Tag.tag_id))
+    return dict(query)
+
+def most_used_tags(limit):
+    """(tag id, post count) of the `limit` tags with the most posts, most used first.
+
+    With TAG_COUNTS_DENORMALIZED this is a backwards scan of the (post_count, id)
+    index that stops after `limit` rows; otherwise post_tags is aggregated first.
+    """
+    if current_app.config.get('TAG_COUNTS_DENORMALIZED', True):
+        query = (db.session.query(Tag.id, Tag.post_count).filter(Tag.post_count > 0)
+                 .order_by(Tag.post_count.desc(), Tag.id.desc()))
+    else:
+        count = db.func.count(Post_Tag.post_id)
+        query = (db.session.query(Post_Tag.tag_id, count).group_by(Post_Tag.tag_id)
+                 .order_by(count.desc(), Post_Tag.tag_id.desc()))
+    return query.limit(limit).all()
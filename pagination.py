@@ -0,0 +1,91 @@
+"""Keyset (cursor) pagination for Blogly listings."""
+
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 50
+
+Page = namedtuple('Page', ['items', 'prev_cursor', 'next_cursor'])
+
+def keyset_page(query, column, after=None, before=None, per_page=PAGE_SIZE):
+    """Return one Page of `query` ordered by `column`, starting after/before a cursor.
+
+    Only `per_page + 1` rows are fetched, no matter how deep into the listing the
+    cursor points, since the cursor is turned into a WHERE clause on `column`.
+    """
+    rows = keyset_query(query, column, after=after, before=before, per_page=per_page).all()
+    has_more = len(rows) > per_page
+    if before is not None:
+        rows = rows[:per_page][::-1]
+        return _make_page(rows, column.key, has_prev=has_more, has_next=True)
+    return _make_page(rows[:per_page], column.key, has_prev=after is not None, has_next=has_more)
+
+def keyset_query(query, column, after=None, before=None, per_page=PAGE_SIZE):
+    """The query keyset_page runs: `per_page + 1` rows past the cursor, ordered by `column`.
+
+    `before` pages read backwards, so their rows come newest first.
+    """
+    if before is not None:
+        return query.filter(column < before).order_by(column.desc()).limit(per_page + 1)
+    if after is not None:
+        query = query.filter(column > after)
+    return query.order_by(column).limit(per_page + 1)
+
+def sequence_page(items, key, after=None, before=None, per_page=PAGE_SIZE):
+    """Like keyset_page, for an in-memory list already sorted by the `key` attribute."""
+    keys = [getattr(item, key) for item in items]
+    if before is not None:
+        end = bisect_left(keys, before)
+        start = max(end - per_page, 0)
+        return _make_page(items[start:end], key, has_prev=start > 0, has_next=True)
+
+    start = bisect_right(keys, after) if after is not None else 0
+    end = start + per_page
+    return _make_page(items[start:end], key, has_prev=after is not None, has_next=end < len(items))
+
+def timeline_page(query, time_column, id_column, after=None, before=None, per_page=PAGE_SIZE):
+    """Return one Page of `query` newest first, ordered by (`time_column`, `id_column`).
+
+    Like keyset_page for timelines, where many rows can share a timestamp. Cursors
+    are "<timestamp>_<id>" strings (see parse_timeline_cursor); `after` continues
+    to older rows and `before` goes back to newer ones.
+    """
+    key = tuple_(time_column, id_column)
+    if before is not None:
+        rows = (query.filter(key > tuple_(*before)).order_by(time_column, id_column)
+                .limit(per_page + 1).all())
+        has_more = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return _make_timeline_page(rows, time_column.key, id_column.key, has_prev=has_more, has_next=True)
+
+    if after is not None:
+        query = query.filter(key < tuple_(*after))
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    return _make_timeline_page(rows[:per_page], time_column.key, id_column.key,
+                               has_prev=after is not None, has_next=has_more)
+
+def parse_timeline_cursor(cursor):
+    """(timestamp, id) from a timeline cursor, or None if it is missing or malformed."""
+    try:
+        timestamp, id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+def _make_timeline_page(rows, time_key, id_key, has_prev, has_next):
+    def cursor(row):
+        return f'{getattr(row, time_key).isoformat()}_{getattr(row, id_key)}'
+    if not rows:
+        return Page(rows, None, None)
+    return Page(rows, cursor(rows[0]) if has_prev else None, cursor(rows[-1]) if has_next else None)
+
+def _make_page(rows, key, has_prev, has_next):
+    if not rows:
+        return Page(rows, None, None)
+    prev_cursor = getattr(rows[0], key) if has_prev else None
+    next_cursor = getattr(rows[-1], key) if has_next else None
+    return Page(rows, prev_cursor, next_cursor)
@@ -0,0 +1,135 @@
+"""Opt-in sampling profiler for individual requests.
+
+A request is profiled when its X-Blogly-Profile header equals PROFILE_TOKEN, or,
+at random, for a PROFILE_SAMPLE_RATE fraction of all requests (0.01 profiles one
+in a hundred). With neither configured nothing is profiled and the only cost is
+one header lookup per request.
+
+While a profiled request runs, a sampler thread reads that request's stack every
+PROFILE_INTERVAL seconds. When the response has been sent, the stacks are
+appended to PROFILE_DIR/<endpoint>.folded, one "caller;callee;... count" line
+per distinct stack. That is the folded format of flamegraph.pl, speedscope and
+inferno, and files from many requests or processes can be concatenated:
+
+    flamegraph.pl $PROFILE_DIR/blogly.edit_post.folded > edit_post.svg
+
+PROFILE_DIR has no default: it must be a directory only the app can write to,
+and is created with mode 0700 if missing. Without it, profiled requests are
+sampled but nothing is written.
+
+The profiled response reports the sample count in its Server-Timing header.
+Sampling reads other threads' frames, so it needs the threaded servers; under
+gevent every request shares one thread and the sampler only runs when it yields.
+"""
+
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+logger = logging.getLogger('blogly.profiling')
+
+PROFILE_HEADER = 'X-Blogly-Profile'
+
+def init_profiling(app):
+    app.config.setdefault('PROFILE_TOKEN', None)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_INTERVAL', 0.005)
+    app.config.setdefault('PROFILE_DIR', None)
+    if (app.config['PROFILE_TOKEN'] or app.config['PROFILE_SAMPLE_RATE']) and not app.config['PROFILE_DIR']:
+        logger.warning('profiling is on but PROFILE_DIR is not set, so no profiles will be written')
+
+    @app.before_request
+    def start_profile():
+        if should_profile(app.config):
+            g.profiling = True
+            sampler.start(threading.get_ident(), app.config['PROFILE_INTERVAL'])
+
+    @app.after_request
+    def report_profile(response):
+        if g.get('profiling'):
+            response.headers.add('Server-Timing', f'profile;desc="{sampler.samples(threading.get_ident())} samples"')
+        return response
+
+    @app.teardown_request
+    def save_profile(error=None):
+        if g.pop('profiling', False):
+            stacks = sampler.stop(threading.get_ident())
+            write_folded(app.config['PROFILE_DIR'], request.endpoint or 'none', stacks)
+
+def should_profile(config):
+    token = config['PROFILE_TOKEN']
+    if token and request.headers.get(PROFILE_HEADER) == token:
+        return True
+    return config['PROFILE_SAMPLE_RATE'] > 0 and random.random() < config['PROFILE_SAMPLE_RATE']
+
+def frame_name(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}'
+
+def fold(frame):
+    """The stack of `frame` as one folded line, outermost caller first."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class Sampler:
+    """One background thread sampling the stacks of every thread being profiled."""
+
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.profiles = {}  # thread id: (Counter of folded stacks, interval)
+        self.thread = None
+
+    def start(self, thread_id, interval):
+        with self.changed:
+            self.profiles[thread_id] = (Counter(), interval)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='blogly-profiler', daemon=True)
+                self.thread.start()
+            self.changed.notify()
+
+    def stop(self, thread_id):
+        """Stop sampling the thread; returns its stacks, which no longer change."""
+        with self.changed:
+            stacks, _ = self.profiles.pop(thread_id, (Counter(), None))
+        return stacks
+
+    def samples(self, thread_id):
+        with self.changed:
+            stacks, _ = self.profiles.get(thread_id, (Counter(), None))
+            return sum(stacks.values())
+
+    def run(self):
+        while True:
+            with self.changed:
+                while not self.profiles:
+                    self.changed.wait()
+                interval = min(interval for _, interval in self.profiles.values())
+            frames = sys._current_frames()
+            with self.changed:
+                for thread_id, (stacks, _) in self.profiles.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[fold(frame)] += 1
+            del frames
+            time.sleep(interval)
+
+sampler = Sampler()
+write_lock = threading.Lock()
+
+def write_folded(directory, endpoint, stacks):
+    """Append `stacks` to the endpoint's .folded file in `directory`."""
+    if not directory or not stacks:
+        return
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    path = os.path.join(directory, f'{endpoint}.folded')
+    with write_lock, open(path, 'a') as f:
+        f.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+    logger.info('profile endpoint=%s samples=%d file=%s', endpoint, sum(stacks.values()), path)
@@ -0,0 +1,85 @@
+"""Per-request SQL query statistics for Blogly.
+
+Counts the statements each request issues and the time spent in the database,
+reports them in a Server-Timing header and a log line, and warns when the same
+statement shape repeats often enough to look like an N+1 query pattern.
+"""
+
+import logging
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('blogly.queries')
+
+class QueryStats:
+    """Statements seen during one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.started = time.perf_counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.duration += elapsed
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        """Statement shapes issued more than `threshold` times."""
+        return [(shape, n) for shape, n in self.fingerprints.items() if n > threshold]
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement):
+    """Normalize a statement so that queries differing only in literals or IN-list length match."""
+    shape = re.sub(r'\s+', ' ', statement).strip()
+    shape = re.sub(r"'[^']*'|\b\d+\b", '?', shape)
+    return re.sub(r'\((?:\s*(?:\?|%\(\w+\)s|%s)\s*,?)+\)', '(?)', shape)
+
+def init_query_stats(app):
+    """Collect query statistics for every request handled by `app`."""
+    app.config.setdefault('QUERY_STATS_ENABLED', True)
+    app.config.setdefault('QUERY_REPEAT_THRESHOLD', 10)
+    if not app.config['QUERY_STATS_ENABLED']:
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+
+        db_ms = stats.duration * 1000
+        total_ms = (time.perf_counter() - stats.started) * 1000
+        response.headers.add('Server-Timing', f'db;dur={db_ms:.2f};desc="{stats.count} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.2f}')
+
+        logger.info('query_stats method=%s path=%s status=%s queries=%d db_ms=%.2f total_ms=%.2f',
+                    request.method, request.path, response.status_code, stats.count, db_ms, total_ms)
+        for shape, n in stats.repeated(app.config['QUERY_REPEAT_THRESHOLD']):
+            logger.warning('possible N+1 method=%s path=%s repeats=%d statement="%s"',
+                           request.method, request.path, n, shape)
+        return response
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_stats' in g:
+        conn.info['query_start'] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('query_start', None)
+    if start is not None and has_request_context() and 'query_stats' in g:
+        g.query_stats.record(statement, time.perf_counter() - start)
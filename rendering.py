@@ -0,0 +1,181 @@
+"""Template compilation, streamed rendering, static asset URLs and response compression.
+
+Templates: with TEMPLATE_CACHE on, Jinja keeps compiled template bytecode on
+disk, so a new worker loads templates without recompiling them. The files go to
+TEMPLATE_CACHE_DIR, which must be a directory only the app can write to: whoever
+can write there can plant bytecode the app will run. Without it, Jinja uses its
+own per-user directory in the temp dir, which it creates with mode 0700 and
+refuses to use if another user owns it.
+TEMPLATE_PRECOMPILE compiles every template when the app is created, instead of
+on each template's first request. `flask blogly precompile` fills the cache at
+deploy time.
+
+render_streamed sends a page as Jinja produces it, in chunks, instead of
+building the whole string first.
+
+asset_url('blogly.css') in a template gives /static/blogly.css?v=<content hash>.
+Those URLs change whenever the file does, so they are served with a one-year
+immutable Cache-Control.
+
+HTML, JSON, CSS and JS responses larger than COMPRESS_MIN_SIZE bytes are
+compressed with brotli, if the brotli package is installed and the client
+accepts it, and with gzip otherwise. Streamed responses are compressed chunk by
+chunk. A strong ETag gets the encoding appended ("abc" -> "abc-gzip"), since
+each encoding is a different byte sequence. The suffix is stripped from
+If-None-Match before the view sees it, so conditional requests still match, and
+put back on the 304, which also carries the Vary: Accept-Encoding of the 200.
+Compressed bodies of ETagged responses are cached by ETag, so a cached page
+is compressed once, not on every request.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+import zlib
+from functools import lru_cache
+
+from flask import Response, current_app, request, stream_with_context, url_for
+from jinja2 import FileSystemBytecodeCache
+
+from cache import Cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'text/css', 'text/plain', 'text/xml', 'application/json',
+                'application/javascript', 'application/atom+xml', 'application/rss+xml'}
+ENCODING_SUFFIX = re.compile(r'-(gzip|br)"')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+compressed_cache = Cache('compressed', maxsize=256, ttl=300)
+
+def init_rendering(app):
+    app.config.setdefault('TEMPLATE_CACHE', False)
+    app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+    app.config.setdefault('TEMPLATE_PRECOMPILE', False)
+    app.config.setdefault('STREAM_BUFFER', 40)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('BROTLI_QUALITY', 5)
+
+    if app.config['TEMPLATE_CACHE']:
+        if app.config['TEMPLATE_CACHE_DIR']:
+            os.makedirs(app.config['TEMPLATE_CACHE_DIR'], mode=0o700, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+    app.jinja_env.globals['asset_url'] = asset_url
+    if app.config['TEMPLATE_PRECOMPILE']:
+        precompile_templates(app)
+
+    app.before_request(strip_encoding_from_etags)
+    app.after_request(cache_fingerprinted_assets)
+    app.after_request(compress_response)
+
+def precompile_templates(app):
+    """Compile (or load from the bytecode cache) every template; returns how many there are."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def render_streamed(template_name, **context):
+    """Like render_template, but the response body is generated while it is sent."""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(app.config['STREAM_BUFFER'])
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+@lru_cache(maxsize=256)
+def file_digest(path, mtime):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def asset_url(filename):
+    """URL of a static file, fingerprinted with its content hash."""
+    path = os.path.join(current_app.static_folder, filename)
+    return url_for('static', filename=filename, v=file_digest(path, os.stat(path).st_mtime_ns))
+
+def cache_fingerprinted_assets(response):
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+def strip_encoding_from_etags():
+    header = request.environ.get('HTTP_IF_NONE_MATCH')
+    if header and ENCODING_SUFFIX.search(header):
+        # Remembered so a 304 can carry the same suffixed validator the client stored.
+        request.environ['blogly.etag_encodings'] = set(ENCODING_SUFFIX.findall(header))
+        request.environ['HTTP_IF_NONE_MATCH'] = ENCODING_SUFFIX.sub('"', header)
+        request.__dict__.pop('if_none_match', None)
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compression_level(encoding):
+    return current_app.config['BROTLI_QUALITY' if encoding == 'br' else 'COMPRESS_LEVEL']
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level)
+
+def compress_stream(chunks, encoding, level):
+    """Compress an iterable of chunks, flushing after each so the client gets every chunk as it is made."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def revalidate_compressed(response):
+    """Give a 304 the Vary and the encoding-suffixed ETag of the 200 it stands for."""
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    encoding = choose_encoding()
+    if etag and not weak and encoding in request.environ.get('blogly.etag_encodings', ()):
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code == 304:
+        return revalidate_compressed(response)
+    if response.status_code != 200:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None or response.direct_passthrough:
+        return response
+
+    level = compression_level(encoding)
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            body = compressed_cache.get_or_set(f'{etag}:{encoding}', lambda: compress(data, encoding, level))
+            response.set_etag(f'{etag}-{encoding}')
+        else:
+            body = compress(data, encoding, level)
+        response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
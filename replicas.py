@@ -0,0 +1,139 @@
+"""Routing reads to read replicas.
+
+List replica URIs in SQLALCHEMY_REPLICA_URIS and queries made while handling a
+GET or HEAD request go to one of them, round robin; everything else goes to the
+primary (SQLALCHEMY_DATABASE_URI): other methods, flushes and any INSERT, UPDATE
+or DELETE, and work outside a request such as jobs and CLI commands.
+
+Read-your-writes: a successful write request marks the client's session cookie,
+and its GETs go to the primary for the next REPLICA_STICKY_SECONDS. That covers
+the redirect after a form post, e.g. submit_post to show_post, which would
+otherwise 404 on a replica that has not caught up.
+
+Lag: each replica's replication delay is checked at most once every
+REPLICA_LAG_CHECK_INTERVAL seconds. Replicas further behind than REPLICA_MAX_LAG
+seconds, or that fail the check, are skipped; with none left, reads use the
+primary.
+
+Shared caches: a page or tag list read from a replica could be older than the
+invalidation that emptied its cache entry, and storing it under the new
+generation would serve the stale copy to everyone, including the writer whose
+GETs are pinned to the primary. Code that fills the page or tag cache calls
+read_from_primary first, so a cache miss reads from the primary.
+"""
+
+import itertools
+import logging
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger('blogly.replicas')
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Seconds the replica's replay is behind; 0 when it has replayed everything received.
+POSTGRES_LAG = text("""
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END""")
+
+def replication_lag(engine):
+    """Seconds `engine` lags its primary; databases without replication report 0."""
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as conn:
+        return float(conn.execute(POSTGRES_LAG).scalar() or 0)
+
+class Replicas:
+    """The replica binds of one app, with their last measured lag."""
+
+    def __init__(self, app):
+        self.app = app
+        self.keys = [f'replica_{number}' for number in range(len(app.config['SQLALCHEMY_REPLICA_URIS']))]
+        self.lag = {}  # bind key: (monotonic time checked, lag in seconds or None if unreachable)
+        self.turn = itertools.count()
+        self.counts = {'replica': 0, 'primary': 0, 'fallback': 0}
+
+    def current_lag(self, key, engine):
+        checked, lag = self.lag.get(key, (None, None))
+        now = time.monotonic()
+        if checked is None or now - checked >= self.app.config['REPLICA_LAG_CHECK_INTERVAL']:
+            try:
+                lag = self.app.config['REPLICA_LAG_PROBE'](engine)
+            except Exception:
+                logger.warning('replica %s is unreachable, reading from the primary', key, exc_info=True)
+                lag = None
+            self.lag[key] = (now, lag)
+        return lag
+
+    def choose(self, db):
+        """An engine of a replica that is close enough behind, or None to use the primary."""
+        start = next(self.turn)
+        for offset in range(len(self.keys)):
+            key = self.keys[(start + offset) % len(self.keys)]
+            engine = db.get_engine(self.app, bind=key)
+            lag = self.current_lag(key, engine)
+            if lag is not None and lag <= self.app.config['REPLICA_MAX_LAG']:
+                return engine
+        return None
+
+def reads_may_use_replica():
+    return has_request_context() and g.get('read_from_replica', False)
+
+def read_from_primary():
+    """Send the rest of this request's reads to the primary, e.g. before filling a shared cache."""
+    if has_request_context():
+        g.read_from_replica = False
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('blogly_replicas')
+        if replicas is None or self._flushing or isinstance(clause, UpdateBase) or not reads_may_use_replica():
+            return super().get_bind(mapper, clause)
+
+        # One choice per request, so a page never mixes rows from replicas at different points.
+        if 'replica_engine' not in g:
+            g.replica_engine = replicas.choose(self.db)
+            replicas.counts['replica' if g.replica_engine is not None else 'fallback'] += 1
+        return g.replica_engine or super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose session sends request reads to replicas; see init_replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+def init_replicas(app, db):
+    """Register the replicas in SQLALCHEMY_REPLICA_URIS as binds and route GET requests to them."""
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('REPLICA_MAX_LAG', 5)
+    app.config.setdefault('REPLICA_LAG_CHECK_INTERVAL', 1)
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+    app.config.setdefault('REPLICA_LAG_PROBE', replication_lag)
+    if not app.config['SQLALCHEMY_REPLICA_URIS']:
+        return
+
+    replicas = app.extensions['blogly_replicas'] = Replicas(app)
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update(zip(replicas.keys, app.config['SQLALCHEMY_REPLICA_URIS']))
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    @app.before_request
+    def route_reads():
+        sticky = session.get('primary_until', 0) > time.time()
+        g.read_from_replica = request.method in READ_METHODS and not sticky
+        if request.method in READ_METHODS and sticky:
+            replicas.counts['primary'] += 1
+
+    @app.after_request
+    def stick_to_primary_after_writes(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
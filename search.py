@@ -0,0 +1,176 @@
+"""Full-text search over post titles and content.
+
+On PostgreSQL, posts carry a generated `search_vector` tsvector column with a GIN
+index, so the database keeps the index current on every insert and update. On
+other databases (SQLite test runs) a pure-Python inverted index stands in. It is
+built from the posts table on first use and then kept current by reindex_post
+jobs and unindex_posts as posts are created, edited and deleted.
+
+Either way results are ranked, paginated, and come with a highlighted snippet
+instead of the full post body.
+"""
+
+import math
+import re
+import threading
+from collections import namedtuple, defaultdict
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from models import db, Post
+from jobs import job
+
+SearchResult = namedtuple('SearchResult', ['id', 'user_id', 'title', 'snippet'])
+
+START, STOP = '\x02', '\x03'
+SNIPPET_LENGTH = 160
+TITLE_WEIGHT = 2
+
+POSTGRES_SEARCH = text(f"""
+    SELECT posts.id, posts.user_id, posts.title,
+           ts_headline('english', coalesce(posts.content, ''), query,
+                       'StartSel={START}, StopSel={STOP}, MaxWords=30, MinWords=10') AS snippet
+    FROM posts, plainto_tsquery('english', :q) AS query
+    WHERE posts.search_vector @@ query
+    ORDER BY ts_rank(posts.search_vector, query) DESC, posts.id
+    LIMIT :limit OFFSET :offset
+""")
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+def highlight(snippet):
+    """Escape a snippet and turn its START/STOP markers into <mark> tags."""
+    return Markup(str(escape(snippet)).replace(START, '<mark>').replace(STOP, '</mark>'))
+
+class SearchIndex:
+    """In-memory inverted index of post titles and content."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.by_user = defaultdict(set)
+        self.built = False
+        self._lock = threading.RLock()
+
+    def reset(self):
+        with self._lock:
+            self.postings.clear()
+            self.documents.clear()
+            self.by_user.clear()
+            self.built = False
+
+    def build(self, rows):
+        """Index (id, user_id, title, content) rows from scratch."""
+        with self._lock:
+            self.reset()
+            for row in rows:
+                self.add(*row)
+            self.built = True
+
+    def add(self, post_id, user_id, title, content):
+        with self._lock:
+            self.remove(post_id)
+            weights = defaultdict(int)
+            for term in tokenize(title):
+                weights[term] += TITLE_WEIGHT
+            for term in tokenize(content):
+                weights[term] += 1
+            for term, weight in weights.items():
+                self.postings[term][post_id] = weight
+            self.documents[post_id] = (user_id, title, content or '', tuple(weights))
+            self.by_user[user_id].add(post_id)
+
+    def remove(self, post_id):
+        with self._lock:
+            document = self.documents.pop(post_id, None)
+            if document is None:
+                return
+            user_id, title, content, terms = document
+            for term in terms:
+                self.postings[term].pop(post_id, None)
+                if not self.postings[term]:
+                    del self.postings[term]
+            self.by_user[user_id].discard(post_id)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            for post_id in list(self.by_user.pop(user_id, ())):
+                self.remove(post_id)
+
+    def search(self, q, offset=0, limit=10):
+        """Posts containing every term of `q`, best tf-idf score first."""
+        terms = set(tokenize(q))
+        if not terms:
+            return []
+        with self._lock:
+            matches = [self.postings.get(term, {}) for term in terms]
+            if not all(matches):
+                return []
+            candidates = set.intersection(*(set(posting) for posting in matches))
+            total = len(self.documents)
+            scores = {post_id: sum(posting[post_id] * math.log(1 + total / len(posting)) for posting in matches)
+                      for post_id in candidates}
+            ranked = sorted(scores, key=lambda post_id: (-scores[post_id], post_id))[offset:offset + limit]
+            return [self._result(post_id, terms) for post_id in ranked]
+
+    def _result(self, post_id, terms):
+        user_id, title, content, _ = self.documents[post_id]
+        return SearchResult(post_id, user_id, title, highlight(snippet(content, terms)))
+
+def snippet(content, terms):
+    """A window of `content` around the first matching term, with matches wrapped in START/STOP."""
+    words = list(re.finditer(r'\w+', content))
+    first = next((word.start() for word in words if word.group().lower() in terms), 0)
+    start = max(first - SNIPPET_LENGTH // 4, 0)
+    window = content[start:start + SNIPPET_LENGTH]
+    marked = re.sub(r'\w+', lambda word: f'{START}{word.group()}{STOP}' if word.group().lower() in terms else word.group(), window)
+    return ('…' if start else '') + marked + ('…' if start + SNIPPET_LENGTH < len(content) else '')
+
+search_index = SearchIndex()
+
+def uses_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+def fallback_index():
+    """The in-memory index, built from the posts table the first time it is needed."""
+    if not search_index.built:
+        rows = db.session.query(Post.id, Post.user_id, Post.title, Post.content).yield_per(1000)
+        search_index.build(rows)
+    return search_index
+
+def search_posts(q, page=1, per_page=10):
+    """One page of ranked results for `q`, plus whether another page follows."""
+    offset = (page - 1) * per_page
+    if uses_postgres():
+        rows = db.session.execute(POSTGRES_SEARCH, {'q': q, 'limit': per_page + 1, 'offset': offset})
+        results = [SearchResult(row.id, row.user_id, row.title, highlight(row.snippet)) for row in rows]
+    else:
+        results = fallback_index().search(q, offset=offset, limit=per_page + 1)
+    return results[:per_page], len(results) > per_page
+
+def index_post(post):
+    """Update the search index after a post is created or edited."""
+    if not uses_postgres() and search_index.built:
+        search_index.add(post.id, post.user_id, post.title, post.content)
+
+def unindex_posts(post_ids):
+    """Drop deleted posts from the search index."""
+    if not uses_postgres():
+        for post_id in post_ids:
+            search_index.remove(post_id)
+
+def unindex_user(user_id):
+    """Drop a deleted user's posts from the search index."""
+    if not uses_postgres():
+        search_index.remove_user(user_id)
+
+@job
+def reindex_post(post_id):
+    """Job: bring the index in line with the post as it is now, dropping it if it was deleted."""
+    post = Post.query.get(post_id)
+    if post is None:
+        unindex_posts([post_id])
+    else:
+        index_post(post)
@@ -0,0 +1,123 @@
+"""Standalone servers for Blogly: a pooled-thread sync mode and a gevent async mode.
+
+    python serve.py --mode sync --threads 8
+    python serve.py --mode async --concurrency 1000
+
+In async mode the process is monkey-patched by gevent before anything else is
+imported, and psycopg2 is made cooperative with psycogreen. Every blocking
+database round trip then yields to other requests instead of holding a worker
+thread, so slow clients and slow queries no longer exhaust the server. Async mode
+serves only the read-only pages (READ_ENDPOINTS) by default; put it behind a proxy
+that sends GETs for those routes here and everything else to the sync workers.
+With gunicorn the same mode is `gunicorn -k gevent "serve:create_async_app()"`:
+gunicorn's gevent worker monkey-patches the process before loading the app, but
+knows nothing of psycopg2, so create_async_app installs psycogreen's wait
+callback itself.
+
+Size DB_POOL_SIZE / DB_MAX_OVERFLOW for the concurrency you allow, or requests
+will queue for connections instead of for threads.
+"""
+
+import argparse
+import time
+
+READ_ENDPOINTS = {'blogly.user_list', 'blogly.show_user', 'blogly.show_post', 'blogly.tag_list', 'blogly.show_tag'}
+
+def patch_for_gevent():
+    """Make sockets, sleeps and psycopg2 cooperative. Must run before the app is imported."""
+    from gevent import monkey
+    monkey.patch_all()
+    patch_psycopg_for_gevent()
+
+def patch_psycopg_for_gevent():
+    """Have psycopg2 wait for the database through gevent instead of blocking the process.
+
+    psycogreen is required: without it every query would block the whole async
+    worker, so a missing install fails at startup with its ImportError.
+    """
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+def restrict_to_reads(app):
+    """Answer 404 for anything but GETs of the read-only pages, so misrouted writes fail loudly."""
+    from flask import abort, request
+
+    @app.before_request
+    def only_read_endpoints():
+        if request.method not in ('GET', 'HEAD') or request.endpoint not in READ_ENDPOINTS:
+            abort(404)
+    return app
+
+def create_async_app(**overrides):
+    """The read-only app for gevent workers, which have already monkey-patched the process."""
+    patch_psycopg_for_gevent()
+    from app import create_app
+    return restrict_to_reads(create_app(**overrides))
+
+def simulate_db_latency(seconds):
+    """Sleep before every statement, to stand in for the round trip to a remote database."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def delay(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(seconds)
+
+def serve_sync(app, host, port, threads):
+    from concurrent.futures import ThreadPoolExecutor
+    from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+    class PooledWSGIServer(WSGIServer):
+        """Handles at most `threads` requests at once, like a fixed pool of sync workers."""
+        executor = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self.handle_pooled, request, client_address)
+
+        def handle_pooled(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    make_server(host, port, app, server_class=PooledWSGIServer, handler_class=QuietHandler).serve_forever()
+
+def serve_async(app, host, port, concurrency):
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    WSGIServer((host, port), app, spawn=Pool(concurrency), log=None).serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8, help='request threads in sync mode')
+    parser.add_argument('--concurrency', type=int, default=1000, help='greenlets in async mode')
+    parser.add_argument('--db-latency', type=float, default=0, help='simulated ms per statement')
+    parser.add_argument('--all-routes', action='store_true', help='serve writes too in async mode')
+    args = parser.parse_args()
+
+    if args.mode == 'async':
+        patch_for_gevent()
+    if args.db_latency:
+        simulate_db_latency(args.db_latency / 1000)
+
+    from app import create_app
+    app = create_app()
+    if args.mode == 'async':
+        if not args.all_routes:
+            restrict_to_reads(app)
+        serve_async(app, args.host, args.port, args.concurrency)
+    else:
+        serve_sync(app, args.host, args.port, args.threads)
+
+if __name__ == '__main__':
+    main()
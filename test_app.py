@@ -1,57 +1,94 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
 from unittest import TestCase
+from xml.etree import ElementTree
+from contextlib import contextmanager
+from sqlalchemy import event
 
-from app import app
-from models import db, User, Post, Tag
+from app import create_app, user_posts, tag_posts
+from config import TestConfig
+from models import db, connect_db, User, Post, Tag, Post_Tag, Job, FeedEntry, check_if_users_post, tag_in_posts_by_ids, set_post_tags
+from pagination import PAGE_SIZE, keyset_query
+from query_stats import fingerprint
+from cache import caches, tag_cache, page_cache, DictBackend
+from search import search_index
+from rendering import compressed_cache
+from jobs import job, jobs
+from profiling import write_folded
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
-app.config['SQLALCHEMY_ECHO'] = False
-
-app.config['TESTING'] = True
-
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app = create_app(TestConfig)
 
 db.drop_all()
 db.create_all()
 
-class BloglyUserViewsTestCase(TestCase):
-    """Tests Blogly View Functions."""
+def explain(query):
+    """The database's query plan for an ORM query, as text."""
+    statement = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        rows = db.session.execute(f'EXPLAIN {statement}')
+    else:
+        rows = db.session.execute(f'EXPLAIN QUERY PLAN {statement}')
+    return '\n'.join(str(row) for row in rows)
 
-    def setUp(self):
-        """Add John Doe as Test User."""
+@contextmanager
+def count_queries():
+    """Collect every SQL statement issued inside the block."""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+class BloglyTestCase(TestCase):
+    """Base of the view tests: empty tables and caches, then John Doe and a Cool tag."""
 
+    def setUp(self):
+        Post_Tag.query.delete()
         User.query.delete()
         Post.query.delete()
         Tag.query.delete()
+        tag_cache.clear()
+        page_cache.clear()
+        search_index.reset()
 
-        user = User(first_name='John', last_name='Doe')
-
-        db.session.add(user)
+        self.user = User(first_name='John', last_name='Doe')
+        self.tag = Tag(name='Cool')
+        db.session.add_all([self.user, self.tag])
         db.session.commit()
+        self.user_id = self.user.id
+        self.tag_id = self.tag.id
 
-        post = Post(title='Very Happy Days!', content='There are days, when people are happy!', user_id=user.id, created_at="2024-03-07 15:42:19.872619")
+    def tearDown(self):
+        """Clean up left over transactions."""
 
-        db.session.add(post)
-        db.session.commit()
+        db.session.rollback()
 
-        tag = Tag(name='Cool')
+class BloglyUserViewsTestCase(BloglyTestCase):
+    """Tests Blogly View Functions."""
 
-        db.session.add(tag)
-        db.session.commit()
+    def setUp(self):
+        """Add a post for John Doe."""
 
-        self.user_id = user.id
-        self.user = user
+        super().setUp()
+        post = Post(title='Very Happy Days!', content='There are days, when people are happy!', user_id=self.user_id, created_at="2024-03-07 15:42:19.872619")
+
+        db.session.add(post)
+        db.session.commit()
 
         self.post_id = post.id
         self.post = post
 
-        self.tag_id = tag.id
-        self.tag = tag
-
-    def tearDown(self):
-        """Clean up left over transactions."""
-
-        db.session.rollback()
-
     def test_user_list(self):
         with app.test_client() as client:
             resp = client.get("/users")
@@ -60,6 +97,33 @@ class BloglyUserViewsTestCase(TestCase):
             self.assertIn('John Doe', html)
             self.assertEqual(resp.status_code, 200)
 
+    def test_user_list_pagination(self):
+        jane = User(first_name='Jane', last_name='Smith')
+        db.session.add(jane)
+        db.session.commit()
+
+        app.config['PAGE_SIZE'] = 1
+        try:
+            with app.test_client() as client:
+                resp = client.get("/users")
+                html = resp.get_data(as_text=True)
+
+                self.assertIn('John Doe', html)
+                self.assertNotIn('Jane Smith', html)
+                self.assertIn(f'href="?after={self.user_id}"', html)
+                self.assertNotIn('PREV', html)
+
+                resp = client.get(f"/users?after={self.user_id}")
+                html = resp.get_data(as_text=True)
+
+                self.assertIn('Jane Smith', html)
+                self.assertNotIn('John Doe', html)
+                self.assertIn(f'href="?before={jane.id}"', html)
+                self.assertNotIn('NEXT', html)
+                self.assertEqual(resp.status_code, 200)
+        finally:
+            app.config['PAGE_SIZE'] = PAGE_SIZE
+
     def test_show_user(self):
         with app.test_client() as client:
             resp = client.get(f"/users/{self.user_id}")
@@ -188,4 +252,935 @@ class BloglyUserViewsTestCase(TestCase):
 
             self.assertIn('Uncool!', html)
             self.assertNotIn('Cool', html)
-            self.assertEqual(resp.status_code, 200)
\ No newline at end of file
+            self.assertEqual(resp.status_code, 200)
+
+
+class BloglyViewsQueryTestCase(BloglyTestCase):
+    """Tests the number and shape of queries issued by views and model helpers."""
+
+    def setUp(self):
+        """Add one post for John Doe."""
+
+        super().setUp()
+        post = Post(title='Very Happy Days!', content='There are days, when people are happy!', user_id=self.user_id)
+        db.session.add(post)
+        db.session.commit()
+
+        self.post_id = post.id
+        self.post = post
+
+    def test_ownership_and_tag_helpers(self):
+        other = User(first_name='Jane', last_name='Smith')
+        db.session.add(other)
+        self.post.tags.append(self.tag)
+        db.session.commit()
+
+        self.assertTrue(check_if_users_post(user_id=self.user_id, post_id=self.post_id))
+        self.assertFalse(check_if_users_post(user_id=other.id, post_id=self.post_id))
+        self.assertTrue(tag_in_posts_by_ids(tag_id=self.tag_id, post_id=self.post_id))
+        self.assertFalse(tag_in_posts_by_ids(tag_id=self.tag_id, post_id=self.post_id + 1))
+
+    def test_edit_post_query_budget(self):
+        for i in range(20):
+            tag = Tag(name=f'Tag {i}')
+            self.post.tags.append(tag)
+        db.session.commit()
+
+        with app.test_client() as client:
+            with count_queries() as statements:
+                resp = client.get(f'/users/{self.user_id}/post/{self.post_id}/{self.post.title}/edit')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(html.count(' checked>'), 20)
+            self.assertLessEqual(len(statements), 5)
+            self.assertEqual(resp.status_code, 200)
+
+    def test_server_timing_header(self):
+        with app.test_client() as client:
+            resp = client.get('/users')
+
+            self.assertIn('db;dur=', resp.headers['Server-Timing'])
+            self.assertIn('queries"', resp.headers['Server-Timing'])
+            self.assertEqual(resp.status_code, 200)
+
+    def test_repeated_statement_warning(self):
+        app.config['QUERY_REPEAT_THRESHOLD'] = 0
+        try:
+            with app.test_client() as client:
+                with self.assertLogs('blogly.queries', level='WARNING') as logs:
+                    client.get(f'/users/{self.user_id}')
+
+                self.assertIn('possible N+1', logs.output[0])
+        finally:
+            app.config['QUERY_REPEAT_THRESHOLD'] = 10
+
+    def test_statement_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT * FROM posts WHERE id IN (?, ?, ?)'),
+                         fingerprint('SELECT *\n FROM posts WHERE id IN (?)'))
+        self.assertEqual(fingerprint("SELECT * FROM tags WHERE name = 'a' LIMIT 5"),
+                         'SELECT * FROM tags WHERE name = ? LIMIT ?')
+
+    def test_submit_post_with_many_tags(self):
+        tags = [Tag(name=f'Tag {i}') for i in range(50)]
+        db.session.add_all(tags)
+        db.session.commit()
+        tag_ids = [tag.id for tag in tags]
+
+        with app.test_client() as client:
+            with count_queries() as statements:
+                resp = client.post(f'/users/{self.user_id}/new-post',
+                                   data={'title': 'Tagged', 'content': 'Lots of tags', 'tag': tag_ids})
+
+            post = Post.query.filter_by(title='Tagged').one()
+            self.assertEqual(sorted(tag.id for tag in post.tags), sorted(tag_ids))
+            # One more than before feeds: the INSERT ... SELECT of the post's feed entries.
+            self.assertLessEqual(len(statements), 7)
+            self.assertEqual(resp.status_code, 302)
+
+    def test_edit_post_changes_only_tag_diff(self):
+        tags = [Tag(name=f'Tag {i}') for i in range(4)]
+        db.session.add_all(tags)
+        self.post.tags.extend(tags[:2])
+        db.session.commit()
+        tag_ids = [tag.id for tag in tags]
+
+        with app.test_client() as client:
+            with count_queries() as statements:
+                client.post(f'/users/{self.user_id}/post/{self.post_id}/{self.post.title}/edit',
+                            data={'title': 'Retagged', 'content': '', 'tag': tag_ids[1:]})
+
+            deletes = [s for s in statements if s.startswith('DELETE FROM post_tags')]
+            inserts = [s for s in statements if s.startswith('INSERT INTO post_tags')]
+            self.assertEqual(len(deletes), 1)
+            self.assertEqual(len(inserts), 1)
+            self.assertEqual(sorted(tag.id for tag in Post.query.get(self.post_id).tags), tag_ids[1:])
+
+    def test_tag_only_edit_moves_updated_at(self):
+        Post.query.filter_by(id=self.post_id).update({'updated_at': datetime(2020, 1, 1)})
+        db.session.commit()
+
+        with app.test_client() as client:
+            client.post(f'/users/{self.user_id}/post/{self.post_id}/{self.post.title}/edit',
+                        data={'title': self.post.title, 'content': self.post.content, 'tag': [self.tag_id]})
+
+            self.assertGreater(Post.query.get(self.post_id).updated_at, datetime(2020, 1, 1))
+            resp = client.get(f'/users/{self.user_id}/post/{self.post_id}/x',
+                              headers={'If-Modified-Since': 'Sat, 01 Jan 2050 00:00:00 GMT'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Cool', resp.get_data(as_text=True))
+
+    def test_user_page_revalidates_after_a_post_is_deleted(self):
+        url = f'/users/{self.user_id}'
+        with app.test_client() as client:
+            resp = client.get(url)
+            etag = resp.headers['ETag']
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            client.post(f'/users/{self.user_id}/post/{self.post_id}/x', data={'ACTION': 'delete'})
+            resp = client.get(url, headers={'If-None-Match': etag,
+                                            'If-Modified-Since': 'Sat, 01 Jan 2050 00:00:00 GMT'})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn(self.post.title, resp.get_data(as_text=True))
+
+    def test_tag_catalogue_is_cached(self):
+        with app.test_client() as client:
+            client.get(f'/users/{self.user_id}/new-post')
+            with count_queries() as statements:
+                resp = client.get('/tags')
+
+            self.assertIn('Cool', resp.get_data(as_text=True))
+            self.assertFalse([s for s in statements if 'tags.name' in s])
+
+            client.post(f'/tags/{self.tag_id}/edit', data={'tag_name': 'Renamed'})
+            resp = client.get('/tags')
+
+            self.assertIn('Renamed', resp.get_data(as_text=True))
+            self.assertGreater(client.get('/cache/stats').get_json()['tags']['hits'], 0)
+
+    def test_post_page_conditional_get(self):
+        url = f'/users/{self.user_id}/post/{self.post_id}/{self.post.title}'
+        with app.test_client() as client:
+            resp = client.get(url)
+            etag = resp.headers['ETag']
+
+            self.assertFalse(etag.startswith('W/'))
+            # Tag names on the page change without touching any timestamp, so only the ETag validates it.
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            with count_queries() as statements:
+                resp = client.get(url, headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(statements, [])
+
+            client.post(f'{url}/edit', data={'title': 'Edited', 'content': 'New content'})
+            resp = client.get(url, headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('New content', resp.get_data(as_text=True))
+
+    def test_user_page_invalidated_by_user_edit(self):
+        with app.test_client() as client:
+            client.get(f'/users/{self.user_id}')
+            client.post(f'/users/{self.user_id}/edit',
+                        data={'first_name': 'Walter', 'last_name': 'White', 'image_url': ''})
+            resp = client.get(f'/users/{self.user_id}')
+
+            self.assertIn('Walter White', resp.get_data(as_text=True))
+
+    def test_user_posts_use_author_index(self):
+        for cursor in ({}, {'after': self.post_id}, {'before': self.post_id}):
+            plan = explain(keyset_query(user_posts(self.user_id), Post.id, **cursor))
+
+            self.assertIn('ix_posts_user_id_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_tag_posts_use_tag_index(self):
+        for cursor in ({}, {'after': self.post_id}, {'before': self.post_id}):
+            plan = explain(keyset_query(tag_posts(self.tag_id), Post_Tag.post_id, **cursor))
+
+            self.assertIn('ix_post_tags_tag_id_post_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_tag_name_lookup_uses_lower_index(self):
+        plan = explain(Tag.query.filter(db.func.lower(Tag.name) == 'cool'))
+
+        self.assertIn('ix_tags_name_lower', plan)
+
+    def test_search_follows_post_changes(self):
+        with app.test_client() as client:
+            resp = client.get('/search?q=happy')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('Very Happy Days!', html)
+            self.assertIn('<mark>happy</mark>', html)
+
+            client.post(f'/users/{self.user_id}/new-post', data={'title': 'Gardening', 'content': 'Tomatoes need sun.'})
+            self.assertIn('Gardening', client.get('/search?q=tomatoes').get_data(as_text=True))
+
+            client.post(f'/users/{self.user_id}/post/{self.post_id}/{self.post.title}', data={'ACTION': 'delete'})
+            html = client.get('/search?q=happy').get_data(as_text=True)
+
+            self.assertIn('No results for', html)
+
+    def test_tag_counts_follow_post_changes(self):
+        set_post_tags(self.post, [self.tag_id])
+        db.session.commit()
+
+        with app.test_client() as client:
+            client.post(f'/users/{self.user_id}/new-post', data={'title': 'Second', 'content': '', 'tag': [self.tag_id]})
+            self.assertEqual(Tag.query.get(self.tag_id).post_count, 2)
+
+            client.post(f'/users/{self.user_id}/post/{self.post_id}/Very Happy Days!/edit', data={'title': 'Untagged', 'content': ''})
+            self.assertEqual(Tag.query.get(self.tag_id).post_count, 1)
+
+    def test_tag_list_counts_with_and_without_counter_column(self):
+        set_post_tags(self.post, [self.tag_id])
+        db.session.commit()
+
+        for denormalized in (True, False):
+            app.config['TAG_COUNTS_DENORMALIZED'] = denormalized
+            try:
+                with app.test_client() as client:
+                    with count_queries() as statements:
+                        html = client.get('/tags').get_data(as_text=True)
+
+                    self.assertIn('title="1 posts">Cool</a>', html)
+                    self.assertIn('<span class="badge text-bg-secondary">1</span>', html)
+                    # The tag list (cached after the first request), counts for the page's tags and the cloud.
+                    self.assertLessEqual(len(statements), 3)
+            finally:
+                app.config['TAG_COUNTS_DENORMALIZED'] = True
+
+    def test_tag_cloud_reads_only_the_most_used_tags(self):
+        rare = Tag(name='Rare')
+        db.session.add(rare)
+        db.session.commit()
+        set_post_tags(self.post, [self.tag_id, rare.id])
+        second = Post(title='Second', content='', user_id=self.user_id)
+        db.session.add(second)
+        db.session.commit()
+        set_post_tags(second, [self.tag_id])
+        db.session.commit()
+
+        app.config['TAG_CLOUD_SIZE'] = 1
+        try:
+            for denormalized in (True, False):
+                app.config['TAG_COUNTS_DENORMALIZED'] = denormalized
+                with app.test_client() as client:
+                    with count_queries() as statements:
+                        html = client.get('/tags').get_data(as_text=True)
+
+                self.assertIn('title="2 posts">Cool</a>', html)
+                self.assertNotIn('title="1 posts">Rare</a>', html)
+                self.assertIn('<span class="badge text-bg-secondary">1</span>', html)
+                self.assertTrue(any('LIMIT' in statement for statement in statements))
+        finally:
+            app.config['TAG_CLOUD_SIZE'] = 50
+            app.config['TAG_COUNTS_DENORMALIZED'] = True
+
+    def test_tag_details_join_authors(self):
+        jane = User(first_name='Jane', last_name='Smith')
+        db.session.add(jane)
+        db.session.commit()
+        for user_id in (self.user_id, jane.id):
+            post = Post(title=f'By {user_id}', user_id=user_id)
+            db.session.add(post)
+            db.session.flush()
+            set_post_tags(post, [self.tag_id])
+        db.session.commit()
+
+        with app.test_client() as client:
+            with count_queries() as statements:
+                html = client.get(f'/tags/{self.tag_id}').get_data(as_text=True)
+
+            self.assertIn('Jane Smith</a>', html)
+            self.assertIn('John Doe</a>', html)
+            self.assertLessEqual(len(statements), 2)
+
+
+class BloglyViewsApiTestCase(BloglyTestCase):
+    """Tests the /api/v1 JSON API."""
+
+    def setUp(self):
+        """Add one post for John Doe, tagged Cool."""
+
+        super().setUp()
+        post = Post(title='Very Happy Days!', content='There are days, when people are happy!', user_id=self.user_id)
+        db.session.add(post)
+        db.session.flush()
+        set_post_tags(post, [self.tag_id])
+        db.session.commit()
+
+        self.post_id = post.id
+
+    def test_sparse_fields_and_include(self):
+        with app.test_client() as client:
+            with count_queries() as statements:
+                resp = client.get('/api/v1/posts?fields[posts]=title&include=user,tags&fields[users]=first_name')
+            data = resp.get_json()['data']
+
+            self.assertEqual(data, [{'id': self.post_id, 'title': 'Very Happy Days!',
+                                     'user': {'id': self.user_id, 'first_name': 'John'},
+                                     'tags': [{'id': self.tag_id, 'name': 'Cool'}]}])
+            self.assertEqual(len(statements), 3)
+
+    def test_cursor_pagination(self):
+        db.session.add_all([User(first_name=f'User{i}', last_name='Test') for i in range(3)])
+        db.session.commit()
+
+        with app.test_client() as client:
+            first = client.get('/api/v1/users?limit=2&fields[users]=first_name').get_json()
+            second = client.get(f'/api/v1/users?limit=2&after={first["links"]["next"]}').get_json()
+
+            self.assertEqual(len(first['data']), 2)
+            self.assertEqual(len(second['data']), 2)
+            self.assertIsNone(second['links']['next'])
+
+    def test_batch_applies_all_operations(self):
+        operations = [
+            {'op': 'create', 'type': 'users', 'attributes': {'first_name': 'Jane', 'last_name': 'Smith'}},
+            {'op': 'create', 'type': 'posts', 'attributes': {'user_id': '$0', 'title': 'Hi', 'tag_ids': [self.tag_id]}},
+            {'op': 'update', 'type': 'tags', 'id': self.tag_id, 'attributes': {'name': 'Uncool'}},
+            {'op': 'delete', 'type': 'posts', 'id': self.post_id},
+        ]
+        with app.test_client() as client:
+            resp = client.post('/api/v1/batch', json={'operations': operations})
+            new_post_id = resp.get_json()['data'][1]['id']
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([tag.name for tag in Post.query.get(new_post_id).tags], ['Uncool'])
+            self.assertIsNone(Post.query.get(self.post_id))
+
+    def test_batch_is_atomic(self):
+        operations = [
+            {'op': 'create', 'type': 'users', 'attributes': {'first_name': 'Jane', 'last_name': 'Smith'}},
+            {'op': 'update', 'type': 'users', 'id': 987654, 'attributes': {'first_name': 'Nobody'}},
+        ]
+        with app.test_client() as client:
+            resp = client.post('/api/v1/batch', json={'operations': operations})
+
+            self.assertEqual(resp.status_code, 404)
+            self.assertIn('operation 1', resp.get_json()['error'])
+            self.assertEqual(User.query.filter_by(first_name='Jane').count(), 0)
+
+    def test_batch_rejects_malformed_payloads(self):
+        with app.test_client() as client:
+            for payload in ([1, 2], {'operations': [1]}, {'operations': [{'op': 'create', 'type': 'tags', 'attributes': [1]}]}):
+                resp = client.post('/api/v1/batch', json=payload)
+                self.assertEqual(resp.status_code, 400, payload)
+
+    def test_batch_rejects_malformed_operations(self):
+        operations = [
+            {'op': 'create', 'attributes': {'name': 'Typeless'}},
+            {'op': 'upsert', 'type': 'tags', 'attributes': {'name': 'Unknown op'}},
+            {'op': 'create', 'type': ['tags'], 'attributes': {'name': 'Listed type'}},
+            {'op': 'create', 'type': 'users', 'attributes': {'first_name': ['a'], 'last_name': 'b'}},
+            {'op': 'create', 'type': 'posts', 'attributes': {'title': 'Bad author', 'user_id': 'abc'}},
+            {'op': 'create', 'type': 'posts', 'attributes': {'title': 'Bool author', 'user_id': True}},
+            {'op': 'create', 'type': 'posts', 'attributes': {'title': 'Bad tags', 'user_id': self.user_id, 'tag_ids': ['x']}},
+            {'op': 'update', 'type': 'posts', 'id': 'abc', 'attributes': {'title': 'Bad id'}},
+        ]
+        with app.test_client() as client:
+            for operation in operations:
+                resp = client.post('/api/v1/batch', json={'operations': [operation]})
+
+                self.assertEqual(resp.status_code, 400, operation)
+                self.assertIn('operation 0:', resp.get_json()['error'])
+        self.assertEqual(Post.query.count(), 1)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_batch_resolves_references_in_tag_ids(self):
+        operations = [
+            {'op': 'create', 'type': 'tags', 'attributes': {'name': 'Fresh'}},
+            {'op': 'create', 'type': 'posts', 'attributes': {'title': 'Tagged', 'user_id': self.user_id, 'tag_ids': ['$0']}},
+        ]
+        with app.test_client() as client:
+            resp = client.post('/api/v1/batch', json={'operations': operations})
+
+            self.assertEqual(resp.status_code, 200)
+            post = Post.query.filter_by(title='Tagged').one()
+            self.assertEqual([tag.name for tag in post.tags], ['Fresh'])
+
+    def test_moving_a_post_invalidates_the_old_author(self):
+        other = User(first_name='Jane', last_name='Smith')
+        db.session.add(other)
+        db.session.commit()
+        operations = [{'op': 'update', 'type': 'posts', 'id': self.post_id, 'attributes': {'user_id': other.id}}]
+        with app.test_client() as client:
+            self.assertIn('Very Happy Days!', client.get(f'/users/{self.user_id}').get_data(as_text=True))
+            client.post('/api/v1/batch', json={'operations': operations})
+
+            self.assertNotIn('Very Happy Days!', client.get(f'/users/{self.user_id}').get_data(as_text=True))
+
+class BloglyViewsCliTestCase(BloglyTestCase):
+    """Tests the `flask blogly export` and `flask blogly import` commands."""
+
+    def setUp(self):
+        """Add a Fun tag and three posts for John Doe, two of them tagged."""
+
+        super().setUp()
+        tags = [self.tag, Tag(name='Fun')]
+        db.session.add(tags[1])
+        db.session.commit()
+
+        posts = [Post(title=f'Post {i}', content='Some content.', user_id=self.user_id) for i in range(3)]
+        db.session.add_all(posts)
+        db.session.flush()
+        set_post_tags(posts[0], [tag.id for tag in tags])
+        set_post_tags(posts[1], [tags[0].id])
+        db.session.commit()
+
+        self.runner = app.test_cli_runner()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.dir)
+
+    def export(self, fmt):
+        path = os.path.join(self.dir, f'export.{fmt}')
+        result = self.runner.invoke(args=['blogly', 'export', '--format', fmt, '--output', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        Post_Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        Tag.query.delete()
+        db.session.commit()
+        return path
+
+    def assertRestored(self):
+        user = User.query.one()
+        self.assertEqual((user.first_name, user.last_name), ('John', 'Doe'))
+        self.assertEqual(Post.query.count(), 3)
+        post = Post.query.filter_by(title='Post 0').one()
+        self.assertEqual(sorted(tag.name for tag in post.tags), ['Cool', 'Fun'])
+        self.assertEqual({tag.name: tag.post_count for tag in Tag.query}, {'Cool': 2, 'Fun': 1})
+
+    def test_ndjson_round_trip(self):
+        path = self.export('ndjson')
+
+        result = self.runner.invoke(args=['blogly', 'import', path, '--batch-size', '2'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertRestored()
+
+    def test_csv_round_trip(self):
+        path = self.export('csv')
+
+        result = self.runner.invoke(args=['blogly', 'import', path, '--format', 'csv'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertRestored()
+
+    def test_round_trip_keeps_empty_and_missing_content(self):
+        user = User.query.one()
+        db.session.add_all([Post(title='Empty', content='', user_id=user.id),
+                            Post(title='Null', content=None, user_id=user.id)])
+        db.session.commit()
+
+        for fmt, null_content in (('ndjson', None), ('csv', '')):
+            path = self.export(fmt)
+
+            result = self.runner.invoke(args=['blogly', 'import', path, '--format', fmt])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            contents = {post.title: post.content for post in Post.query}
+            self.assertEqual(contents['Post 0'], 'Some content.')
+            self.assertEqual(contents['Empty'], '')
+            self.assertEqual(contents['Null'], null_content)
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.export('ndjson')
+        checkpoint = os.path.join(self.dir, 'import.checkpoint')
+        with open(path) as f:
+            lines = f.readlines()
+        with open(os.path.join(self.dir, 'head.ndjson'), 'w') as f:
+            f.writelines(lines[:4])
+
+        result = self.runner.invoke(args=['blogly', 'import', f.name, '--checkpoint', checkpoint])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(Post.query.count(), 1)
+
+        result = self.runner.invoke(args=['blogly', 'import', path, '--checkpoint', checkpoint])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Resuming after 4 records', result.output)
+        self.assertRestored()
+
+    def test_resume_skips_a_batch_committed_before_its_checkpoint(self):
+        path = self.export('ndjson')
+        checkpoint = os.path.join(self.dir, 'import.checkpoint')
+        with open(path) as f:
+            lines = f.readlines()
+        with open(os.path.join(self.dir, 'head.ndjson'), 'w') as f:
+            f.writelines(lines[:4])
+        result = self.runner.invoke(args=['blogly', 'import', f.name, '--checkpoint', checkpoint])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        # As if the process died after committing the last batch but before recording it.
+        with open(checkpoint, 'w') as f:
+            f.write('3')
+        result = self.runner.invoke(args=['blogly', 'import', path, '--checkpoint', checkpoint])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertRestored()
+
+    def test_import_creates_missing_tags(self):
+        path = os.path.join(self.dir, 'posts.ndjson')
+        user_id = User.query.one().id
+        with open(path, 'w') as f:
+            f.write(json.dumps({'type': 'post', 'id': 100, 'title': 'New', 'content': 'Hi', 'user_id': user_id,
+                                'tags': ['Cool', 'Brand New']}) + '\n')
+
+        with count_queries() as statements:
+            result = self.runner.invoke(args=['blogly', 'import', path])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(sorted(tag.name for tag in Post.query.get(100).tags), ['Brand New', 'Cool'])
+        self.assertEqual(Tag.query.filter_by(name='Brand New').one().post_count, 1)
+        self.assertEqual(sum('INSERT INTO post_tags' in statement for statement in statements), 1)
+
+class BloglyViewsDeleteTestCase(BloglyTestCase):
+    """Tests batched cascade deletes of users, posts and tags."""
+
+    def setUp(self):
+        """Add five posts for John Doe, each tagged Cool."""
+
+        super().setUp()
+        posts = [Post(title=f'Post {i}', content='Some content.', user_id=self.user_id) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.flush()
+        for post in posts:
+            set_post_tags(post, [self.tag_id])
+        db.session.commit()
+
+        self.post_id = posts[0].id
+        app.config['DELETE_BATCH_SIZE'] = 2
+
+    def tearDown(self):
+        super().tearDown()
+        app.config['DELETE_BATCH_SIZE'] = TestConfig.DELETE_BATCH_SIZE
+        app.config['DELETE_IN_BACKGROUND'] = False
+
+    def test_user_delete_cascades_in_batches(self):
+        with app.test_client() as client, self.assertLogs('blogly.deletes', 'INFO') as logs:
+            resp = client.post(f'/users/{self.user_id}', data={'ACTION': 'delete'})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(User.query.get(self.user_id))
+        self.assertEqual(Post.query.count(), 0)
+        self.assertEqual(Post_Tag.query.count(), 0)
+        self.assertEqual(Tag.query.get(self.tag_id).post_count, 0)
+        self.assertIn(f'user {self.user_id}: deleted 4/5 posts', '\n'.join(logs.output))
+
+    def test_post_delete_cascades_to_post_tags(self):
+        with app.test_client() as client:
+            client.post(f'/users/{self.user_id}/post/{self.post_id}/Post 0', data={'ACTION': 'delete'})
+
+        self.assertIsNone(Post.query.get(self.post_id))
+        self.assertEqual(Post_Tag.query.count(), 4)
+        self.assertEqual(Tag.query.get(self.tag_id).post_count, 4)
+
+    def test_post_delete_through_another_users_url_is_refused(self):
+        other = User(first_name='Jane', last_name='Smith')
+        db.session.add(other)
+        db.session.commit()
+        with app.test_client() as client:
+            self.assertIn('Post 0', client.get(f'/users/{self.user_id}').get_data(as_text=True))
+            resp = client.post(f'/users/{other.id}/post/{self.post_id}/Post 0', data={'ACTION': 'delete'})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNotNone(Post.query.get(self.post_id))
+            self.assertIn('Post 0', client.get(f'/users/{self.user_id}').get_data(as_text=True))
+
+    def test_tag_delete_keeps_posts(self):
+        with app.test_client() as client:
+            client.post(f'/tags/{self.tag_id}', data={'ACTION': 'delete'})
+
+        self.assertIsNone(Tag.query.get(self.tag_id))
+        self.assertEqual(Post_Tag.query.count(), 0)
+        self.assertEqual(Post.query.count(), 5)
+
+    def test_delete_in_background(self):
+        app.config['DELETE_IN_BACKGROUND'] = True
+        app.config['JOBS_EAGER'] = False
+        try:
+            with app.test_client() as client:
+                resp = client.post(f'/users/{self.user_id}', data={'ACTION': 'delete'})
+            self.assertEqual(resp.status_code, 302)
+            self.assertTrue(jobs.wait_idle(10))
+        finally:
+            app.config['JOBS_EAGER'] = True
+
+        db.session.expire_all()
+        self.assertIsNone(User.query.get(self.user_id))
+        self.assertEqual(Post.query.count(), 0)
+
+calls = []
+
+@job
+def flaky_job(value, failures):
+    """Test job: fails `failures` times, then records `value`."""
+    calls.append(value)
+    if calls.count(value) <= failures:
+        raise RuntimeError('try again')
+
+class BloglyViewsJobsTestCase(TestCase):
+    """Tests the background job queue in memory and durable modes."""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+        calls.clear()
+        app.config.update(JOBS_EAGER=False, JOBS_RETRY_DELAY=0.01, JOBS_POLL_INTERVAL=0.05)
+
+    def tearDown(self):
+        app.config.update(JOBS_EAGER=True, JOBS_DURABLE=False)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 10
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.02)
+            db.session.expire_all()
+        self.assertTrue(condition())
+
+    def test_memory_jobs_are_retried(self):
+        with app.app_context():
+            jobs.enqueue('flaky_job', 'a', 2)
+        self.assertTrue(jobs.wait_idle(10))
+
+        self.assertEqual(calls, ['a', 'a', 'a'])
+
+    def test_waiting_job_with_same_key_is_not_queued_twice(self):
+        app.config['JOBS_DURABLE'] = True
+        with app.app_context():
+            self.assertTrue(jobs.enqueue('flaky_job', 'b', 0, key='k', delay=0.2))
+            self.assertFalse(jobs.enqueue('flaky_job', 'b', 0, key='k', delay=0.2))
+
+        self.wait_for(lambda: Job.query.filter_by(status='done').count() == 1)
+        self.assertEqual(calls, ['b'])
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_durable_job_fails_after_max_attempts(self):
+        app.config['JOBS_DURABLE'] = True
+        with app.app_context():
+            jobs.enqueue('flaky_job', 'c', 5)
+
+        self.wait_for(lambda: Job.query.filter_by(status='failed').count() == 1)
+        row = Job.query.one()
+        self.assertEqual(row.attempts, 3)
+        self.assertIn('try again', row.last_error)
+
+    def test_metrics_endpoint(self):
+        app.config['JOBS_DURABLE'] = True
+        with app.app_context():
+            jobs.enqueue('flaky_job', 'd', 0)
+        self.wait_for(lambda: Job.query.filter_by(status='done').count() == 1)
+
+        with app.test_client() as client:
+            metrics = client.get('/jobs/metrics').get_json()
+
+        self.assertEqual(metrics['mode'], 'durable')
+        self.assertEqual(metrics['jobs_by_status'], {'done': 1})
+        self.assertIn('p95', metrics['run_ms'])
+
+class BloglyViewsRenderingTestCase(TestCase):
+    """Tests compression, fingerprinted assets and template precompilation."""
+
+    def setUp(self):
+        User.query.delete()
+        page_cache.clear()
+        compressed_cache.clear()
+        user = User(first_name='John', last_name='Doe')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def test_streamed_page_is_gzipped(self):
+        with app.test_client() as client:
+            resp = client.get('/users', headers={'Accept-Encoding': 'gzip'})
+            body = resp.get_data()
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertIn(b'John Doe', gzip.decompress(body))
+
+    def test_uncompressed_without_accept_encoding(self):
+        with app.test_client() as client:
+            resp = client.get('/users')
+
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn('John Doe', resp.get_data(as_text=True))
+
+    def test_etag_names_the_encoding_and_still_matches(self):
+        with app.test_client() as client:
+            resp = client.get(f'/users/{self.user_id}', headers={'Accept-Encoding': 'gzip'})
+            etag = resp.headers['ETag']
+            self.assertTrue(etag.endswith('-gzip"'))
+
+            resp = client.get(f'/users/{self.user_id}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['ETag'], etag)
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+
+            resp = client.get(f'/users/{self.user_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertFalse(resp.headers['ETag'].endswith('-gzip"'))
+
+    def test_fingerprinted_assets_are_immutable(self):
+        with app.test_client() as client:
+            html = client.get('/users').get_data(as_text=True)
+            url = re.search(r'href="(/static/blogly\.css\?v=\w+)"', html).group(1)
+            resp = client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+
+    def test_precompile_fills_bytecode_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            precompile_app = create_app(TestConfig, TEMPLATE_CACHE=True, TEMPLATE_CACHE_DIR=cache_dir)
+            result = precompile_app.test_cli_runner().invoke(args=['blogly', 'precompile'])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(len(os.listdir(cache_dir)), len(app.jinja_env.list_templates()))
+        finally:
+            shutil.rmtree(cache_dir)
+            connect_db(app)
+
+    def test_default_bytecode_cache_is_private_to_the_user(self):
+        try:
+            directory = create_app(TestConfig, TEMPLATE_CACHE=True).jinja_env.bytecode_cache.directory
+        finally:
+            connect_db(app)
+
+        info = os.stat(directory)
+        self.assertEqual(info.st_uid, os.getuid())
+        self.assertEqual(info.st_mode & 0o077, 0)
+
+class BloglyViewsMetricsTestCase(TestCase):
+    """Tests the Prometheus endpoint and the request profiler."""
+
+    def setUp(self):
+        User.query.delete()
+        page_cache.clear()
+
+    def tearDown(self):
+        app.config['PROFILE_TOKEN'] = None
+        app.config['PROFILE_DIR'] = None
+
+    def test_metrics_exposition(self):
+        client = app.test_client()
+        page = client.get('/tags')
+        page.get_data()
+        page.close()
+        resp = client.get('/metrics')
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE blogly_http_request_duration_seconds histogram', text)
+        self.assertRegex(text, r'blogly_http_request_duration_seconds_count\{method="GET",endpoint="blogly.tag_list",status="200"\} [1-9]')
+        self.assertIn('blogly_http_request_duration_seconds_bucket{method="GET",endpoint="blogly.tag_list",status="200",le="+Inf"}', text)
+        self.assertRegex(text, r'blogly_http_requests_in_flight [1-9]')
+        self.assertIn('blogly_cache_hit_ratio{cache="pages"}', text)
+        self.assertIn('blogly_jobs_total{outcome="succeeded"}', text)
+
+    def test_profile_header_writes_folded_stacks(self):
+        profile_dir = tempfile.mkdtemp()
+        app.config['PROFILE_TOKEN'] = 'secret'
+        app.config['PROFILE_DIR'] = profile_dir
+        try:
+            with app.test_client() as client:
+                client.get('/tags', headers={'X-Blogly-Profile': 'wrong'})
+                self.assertEqual(os.listdir(profile_dir), [])
+
+                original = app.view_functions['blogly.tag_list']
+                app.view_functions['blogly.tag_list'] = lambda: time.sleep(0.05) or original()
+                try:
+                    resp = client.get('/tags', headers={'X-Blogly-Profile': 'secret'})
+                finally:
+                    app.view_functions['blogly.tag_list'] = original
+
+            self.assertIn('profile;desc=', ', '.join(resp.headers.getlist('Server-Timing')))
+            with open(os.path.join(profile_dir, 'blogly.tag_list.folded')) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            stack, count = lines[0].rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+            self.assertIn('test_app.py:<lambda>', ''.join(lines))
+        finally:
+            shutil.rmtree(profile_dir)
+
+    def test_profile_dir_is_created_private(self):
+        parent = tempfile.mkdtemp()
+        try:
+            profile_dir = os.path.join(parent, 'profiles')
+            write_folded(profile_dir, 'blogly.tag_list', Counter({'app.py:tag_list:1': 2}))
+
+            self.assertEqual(os.stat(profile_dir).st_mode & 0o077, 0)
+        finally:
+            shutil.rmtree(parent)
+
+class BloglyViewsFeedTestCase(BloglyTestCase):
+    """Tests the site, user and tag timelines and their Atom and RSS feeds."""
+
+    def setUp(self):
+        """Add five posts for John Doe, each tagged Cool, through the routes."""
+
+        super().setUp()
+        with app.test_client() as client:
+            for i in range(5):
+                client.post(f'/users/{self.user_id}/new-post',
+                            data={'title': f'Post {i}', 'content': f'Content {i}.', 'tag': [str(self.tag_id)]})
+        self.post_ids = [post_id for (post_id,) in db.session.query(Post.id).order_by(Post.id)]
+        app.config['PAGE_SIZE'] = 2
+
+    def tearDown(self):
+        super().tearDown()
+        app.config['PAGE_SIZE'] = TestConfig.PAGE_SIZE
+
+    def feed_titles(self, feed):
+        return [entry.title for entry in FeedEntry.query.filter_by(feed=feed).order_by(FeedEntry.post_id)]
+
+    def test_new_posts_are_in_every_timeline(self):
+        titles = [f'Post {i}' for i in range(5)]
+        self.assertEqual(self.feed_titles('all'), titles)
+        self.assertEqual(self.feed_titles(f'user:{self.user_id}'), titles)
+        self.assertEqual(self.feed_titles(f'tag:{self.tag_id}'), titles)
+
+    def test_pages_are_newest_first_with_cursors(self):
+        with app.test_client() as client:
+            first = client.get('/feed').get_data(as_text=True)
+            self.assertLess(first.index('Post 4'), first.index('Post 3'))
+            self.assertNotIn('Post 2', first)
+
+            after = re.search(r'\?after=([^"]+)"', first).group(1)
+            second = client.get(f'/feed?after={after}').get_data(as_text=True)
+            self.assertIn('Post 2', second)
+            self.assertIn('Post 1', second)
+            self.assertNotIn('Post 3', second)
+
+            before = re.search(r'\?before=([^"]+)"', second).group(1)
+            self.assertIn('Post 4', client.get(f'/feed?before={before}').get_data(as_text=True))
+
+    def test_edit_and_delete_update_timelines(self):
+        post_id = self.post_ids[0]
+        with app.test_client() as client:
+            client.post(f'/users/{self.user_id}/post/{post_id}/Post 0/edit', data={'title': 'Renamed', 'content': 'New.'})
+            self.assertEqual(self.feed_titles('all')[0], 'Renamed')
+            self.assertNotIn('Renamed', self.feed_titles(f'tag:{self.tag_id}'))
+
+            client.post(f'/users/{self.user_id}/post/{self.post_ids[1]}/Post 1', data={'ACTION': 'delete'})
+            self.assertNotIn('Post 1', self.feed_titles('all'))
+            self.assertNotIn('Post 1', self.feed_titles(f'user:{self.user_id}'))
+
+            client.post(f'/tags/{self.tag_id}', data={'ACTION': 'delete'})
+            self.assertEqual(self.feed_titles(f'tag:{self.tag_id}'), [])
+            self.assertEqual(client.get(f'/tags/{self.tag_id}/feed').status_code, 404)
+
+    def test_atom_and_rss_support_conditional_get(self):
+        with app.test_client() as client:
+            resp = client.get(f'/users/{self.user_id}/feed.atom')
+            self.assertEqual(resp.mimetype, 'application/atom+xml')
+            atom = ElementTree.fromstring(resp.get_data())
+            entries = atom.findall('{http://www.w3.org/2005/Atom}entry')
+            self.assertEqual(entries[0].find('{http://www.w3.org/2005/Atom}title').text, 'Post 4')
+            self.assertEqual(len(entries), 2)
+
+            etag = resp.headers['ETag']
+            self.assertEqual(client.get(f'/users/{self.user_id}/feed.atom', headers={'If-None-Match': etag}).status_code, 304)
+
+            client.post(f'/users/{self.user_id}/new-post', data={'title': 'Newest', 'content': ''})
+            resp = client.get(f'/users/{self.user_id}/feed.atom', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Newest', resp.get_data(as_text=True))
+
+            resp = client.get(f'/tags/{self.tag_id}/feed.rss')
+            self.assertEqual(resp.mimetype, 'application/rss+xml')
+            items = ElementTree.fromstring(resp.get_data()).findall('channel/item')
+            self.assertEqual([item.find('title').text for item in items], ['Post 4', 'Post 3'])
+            # Deleting the newest post would move a Last-Modified back in time, so only the ETag validates feeds.
+            self.assertIsNone(resp.last_modified)
+
+            etag = resp.headers['ETag']
+            newest = Post.query.filter_by(title='Post 4').one()
+            client.post(f'/users/{self.user_id}/post/{newest.id}/Post 4', data={'ACTION': 'delete'})
+            resp = client.get(f'/tags/{self.tag_id}/feed.rss', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('Post 4', resp.get_data(as_text=True))
+
+class BloglyViewsCacheBackendTestCase(TestCase):
+    """Tests the CACHE_BACKEND setting, which shares cache invalidation between worker processes."""
+
+    def setUp(self):
+        User.query.delete()
+        user = User(first_name='John', last_name='Doe')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.backend = DictBackend()
+        self.app = create_app(TestConfig, CACHE_BACKEND=self.backend)
+
+    def tearDown(self):
+        create_app(TestConfig)
+        connect_db(app)
+
+    def test_create_app_applies_backend_to_every_cache(self):
+        self.assertTrue(all(cache.backend is self.backend for cache in caches.values()))
+
+    def test_bump_from_another_worker_reaches_this_one(self):
+        with self.app.test_client() as client:
+            self.assertIn('John Doe', client.get(f'/users/{self.user_id}').get_data(as_text=True))
+
+            # Another worker process renames the user and bumps the shared generation.
+            User.query.filter_by(id=self.user_id).update({'first_name': 'Johnny'})
+            db.session.commit()
+            self.backend.incr(f'pages:generation:user:{self.user_id}')
+
+            self.assertIn('Johnny Doe', client.get(f'/users/{self.user_id}').get_data(as_text=True))
@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+from benchmarks.datasets import dataset
+from benchmarks.report import build_report, compare
+from benchmarks.routes import run_routes, uncovered_endpoints
+
+def route(p50_ms=1.0, queries=2, peak_kb=10.0):
+    return {'method': 'GET', 'status': [200], 'p50_ms': p50_ms, 'p95_ms': p50_ms, 'p99_ms': p50_ms,
+            'queries': queries, 'peak_kb': peak_kb}
+
+class BenchmarkTestCase(TestCase):
+    """Tests the route benchmarks and baseline comparison."""
+
+    def test_every_route_runs_against_a_synthetic_dataset(self):
+        with dataset(users=3, posts_per_user=2, tags_per_post=2, tags=3) as app:
+            self.assertEqual(uncovered_endpoints(app), [])
+            routes = run_routes(app, iterations=2, warmup=1)
+
+        for endpoint, result in routes.items():
+            self.assertTrue(all(status < 400 for status in result['status']), endpoint)
+        self.assertEqual(routes['blogly.user_list']['queries'], 1)
+        # Cached pages are measured cold, so they still report the queries that fill the cache.
+        for endpoint in ('blogly.show_user', 'blogly.show_post', 'blogly.site_feed', 'blogly.tag_posts_feed'):
+            self.assertGreater(routes[endpoint]['queries'], 0, endpoint)
+
+    def test_compare_flags_regressions(self):
+        baseline = build_report({'users': 1}, {'blogly.user_list': route(), 'blogly.tag_list': route()})
+        current = build_report({'users': 1}, {'blogly.user_list': route(queries=3), 'blogly.tag_list': route(p50_ms=1.2)})
+
+        self.assertEqual(compare(baseline, current), ['blogly.user_list: queries 2 -> 3'])
+
+        current['routes']['blogly.tag_list'] = route(p50_ms=5.0)
+        self.assertIn('blogly.tag_list: p50 1.0 ms -> 5.0 ms', compare(baseline, current))
+        self.assertNotIn('blogly.tag_list: p50 1.0 ms -> 5.0 ms', compare(baseline, current, latency=False))
@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from cache import Cache, DictBackend
+
+class FakeClock:
+    """A clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class CacheTestCase(TestCase):
+    """Tests the TTL/LRU cache and its generation-based invalidation."""
+
+    def test_read_through_and_stats(self):
+        cache = Cache('test-read-through')
+        loads = []
+        load = lambda: loads.append(1) or ['a', 'b']
+
+        self.assertEqual(cache.get_or_set('all', load), ['a', 'b'])
+        self.assertEqual(cache.get_or_set('all', load), ['a', 'b'])
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hit_ratio'], 0.5)
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = Cache('test-ttl', ttl=10, clock=clock)
+        cache.set('key', 'value')
+
+        clock.now = 9
+        self.assertEqual(cache.get('key'), 'value')
+        clock.now = 11
+        self.assertIsNone(cache.get('key'))
+
+    def test_lru_eviction(self):
+        cache = Cache('test-lru', maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_bump_invalidates_other_workers(self):
+        backend = DictBackend()
+        worker_one = Cache('test-shared', backend=backend)
+        worker_two = Cache('test-shared', backend=backend)
+        worker_one.set('all', ['old'])
+        worker_two.set('all', ['old'])
+
+        worker_one.bump()
+
+        self.assertIsNone(worker_two.get('all'))
+        worker_two.set('all', ['new'])
+        self.assertEqual(worker_one.get('all'), ['new'])
@@ -0,0 +1,34 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import create_app
+from config import TestConfig, engine_options
+from models import db
+
+class ConfigTestCase(TestCase):
+    """Tests environment-driven configuration."""
+
+    def test_pool_settings_from_environment(self):
+        env = {'DB_POOL_SIZE': '20', 'DB_MAX_OVERFLOW': '5', 'DB_POOL_RECYCLE': '600', 'DB_POOL_PRE_PING': '0'}
+        with patch.dict(os.environ, env):
+            options = engine_options('postgresql://localhost/blogly')
+
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 5)
+        self.assertEqual(options['pool_recycle'], 600)
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_sqlite_gets_no_pool_settings(self):
+        self.assertEqual(engine_options('sqlite:///blogly.db'), {})
+
+    def test_engine_options_follow_the_database_override(self):
+        previous_app = db.app
+        try:
+            app = create_app(TestConfig, SQLALCHEMY_DATABASE_URI='sqlite://')
+            self.assertEqual(app.config['SQLALCHEMY_ENGINE_OPTIONS'], {})
+
+            app = create_app(TestConfig, SQLALCHEMY_DATABASE_URI='sqlite://', SQLALCHEMY_ENGINE_OPTIONS={'echo': True})
+            self.assertEqual(app.config['SQLALCHEMY_ENGINE_OPTIONS'], {'echo': True})
+        finally:
+            db.app = previous_app
@@ -0,0 +1,59 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+
+from models import db
+from migrations import upgrade, current_version, HEAD
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE users (id INTEGER PRIMARY KEY, first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL, image_url VARCHAR NOT NULL)',
+    'CREATE TABLE posts (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, content VARCHAR, created_at DATETIME NOT NULL, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE)',
+    'CREATE TABLE tags (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)',
+    'CREATE TABLE post_tags (post_id INTEGER REFERENCES posts (id) ON DELETE CASCADE, tag_id INTEGER REFERENCES tags (id) ON DELETE CASCADE, PRIMARY KEY (post_id, tag_id))',
+    "INSERT INTO users VALUES (1, 'John', 'Doe', '')",
+    "INSERT INTO posts VALUES (1, 'Hello', 'World', '2024-03-07 15:42:19', 1)",
+]
+
+class MigrationsTestCase(TestCase):
+    """Tests upgrading fresh and pre-migration databases."""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def version(self):
+        with self.engine.connect() as conn:
+            return current_version(conn)
+
+    def index_names(self, table):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"), t=table)
+            return {name for (name,) in rows}
+
+    def test_fresh_database_is_created_at_head(self):
+        self.assertEqual(upgrade(self.engine, db.metadata), HEAD)
+        self.assertEqual(self.version(), HEAD)
+        self.assertIn('ix_posts_user_id_id', self.index_names('posts'))
+
+    def test_legacy_database_is_migrated(self):
+        with self.engine.begin() as conn:
+            for statement in LEGACY_SCHEMA:
+                conn.execute(text(statement))
+
+        self.assertEqual(upgrade(self.engine, db.metadata), HEAD)
+
+        with self.engine.connect() as conn:
+            updated_at = conn.execute(text('SELECT updated_at FROM posts')).scalar()
+        self.assertTrue(str(updated_at).startswith('2024-03-07 15:42:19'))
+        self.assertIn('ix_posts_user_id_id', self.index_names('posts'))
+        self.assertNotIn('ix_posts_user_id_created_at', self.index_names('posts'))
+        self.assertIn('ix_post_tags_tag_id_post_id', self.index_names('post_tags'))
+        self.assertIn('ix_tags_name_lower', self.index_names('tags'))
+        self.assertIn('ix_jobs_status_run_at', self.index_names('jobs'))
+        with self.engine.connect() as conn:
+            feeds = {feed for (feed,) in conn.execute(text('SELECT feed FROM feed_entries WHERE post_id = 1'))}
+        self.assertEqual(feeds, {'all', 'user:1'})
+
+    def test_upgrade_is_idempotent(self):
+        upgrade(self.engine, db.metadata)
+        self.assertEqual(upgrade(self.engine, db.metadata), HEAD)
+        self.assertEqual(self.version(), HEAD)
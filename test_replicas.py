@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app import create_app
+from cache import caches
+from config import TestConfig
+from models import db, User, Tag
+
+class ReplicaRoutingTestCase(TestCase):
+    """Tests read routing with two SQLite files standing in for a primary and its replica."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.previous_app = db.app
+        db.session.remove()
+        self.app = create_app(TestConfig,
+                              SQLALCHEMY_DATABASE_URI=f'sqlite:///{self.dir}/primary.db',
+                              SQLALCHEMY_REPLICA_URIS=[f'sqlite:///{self.dir}/replica.db'],
+                              REPLICA_LAG_PROBE=lambda engine: self.lag)
+        self.lag = 0
+        self.client = self.app.test_client()
+        for cache in caches.values():
+            cache.clear()
+
+        with self.app.app_context():
+            primary, replica = db.engine, db.get_engine(self.app, 'replica_0')
+            for engine, name in ((primary, 'Primary'), (replica, 'Replica')):
+                db.metadata.create_all(engine)
+                engine.execute(User.__table__.insert(), first_name=name, last_name='User', image_url='')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            for key in (None, 'replica_0'):
+                db.get_engine(self.app, key).dispose()
+        db.app = self.previous_app
+        for cache in caches.values():
+            cache.clear()
+        shutil.rmtree(self.dir)
+
+    def test_get_reads_from_replica(self):
+        html = self.client.get('/users').get_data(as_text=True)
+
+        self.assertIn('Replica User', html)
+        self.assertNotIn('Primary User', html)
+
+    def test_writes_go_to_primary_and_the_redirect_reads_them_back(self):
+        resp = self.client.post('/users', data={'first_name': 'New', 'last_name': 'Person', 'image_url': ''},
+                                follow_redirects=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('New Person', resp.get_data(as_text=True))
+        with self.app.app_context():
+            self.assertEqual(db.engine.execute('SELECT count(*) FROM users').scalar(), 2)
+            self.assertEqual(db.get_engine(self.app, 'replica_0').execute('SELECT count(*) FROM users').scalar(), 1)
+
+    def test_shared_caches_are_filled_from_the_primary(self):
+        with self.app.app_context():
+            db.engine.execute(Tag.__table__.insert(), name='Fresh')
+
+        user_page = self.client.get('/users/1').get_data(as_text=True)
+        tag_page = self.client.get('/tags').get_data(as_text=True)
+
+        self.assertIn('Primary User', user_page)
+        self.assertIn('Fresh', tag_page)
+        self.assertIn('Replica User', self.client.get('/users').get_data(as_text=True))
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.lag = 60
+
+        html = self.client.get('/users').get_data(as_text=True)
+
+        self.assertIn('Primary User', html)
+
+    def test_work_outside_requests_uses_primary(self):
+        with self.app.app_context():
+            self.assertEqual(User.query.one().first_name, 'Primary')
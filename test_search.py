@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from search import SearchIndex
+
+class SearchIndexTestCase(TestCase):
+    """Tests the in-memory full-text index used when PostgreSQL is not available."""
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.build([
+            (1, 1, 'Happy days', 'There are days, when people are happy!'),
+            (2, 1, 'Sad nights', 'There are nights when even the happy get sad.'),
+            (3, 2, 'Gardening', 'Tomatoes need sun & water.'),
+        ])
+
+    def test_ranks_title_matches_first(self):
+        results = self.index.search('happy')
+
+        self.assertEqual([result.id for result in results], [1, 2])
+
+    def test_requires_every_term(self):
+        results = self.index.search('happy nights')
+
+        self.assertEqual([result.id for result in results], [2])
+        self.assertEqual(self.index.search('happy tomatoes'), [])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        snippet = self.index.search('sun')[0].snippet
+
+        self.assertIn('<mark>sun</mark>', snippet)
+        self.assertIn('&amp;', snippet)
+
+    def test_incremental_updates(self):
+        self.index.add(3, 2, 'Gardening', 'Happy tomatoes.')
+        self.assertEqual([result.id for result in self.index.search('happy')], [1, 2, 3])
+        self.assertEqual(self.index.search('sun'), [])
+
+        self.index.remove(1)
+        self.index.remove_user(2)
+        self.assertEqual([result.id for result in self.index.search('happy')], [2])
+
+    def test_pagination(self):
+        self.assertEqual([result.id for result in self.index.search('there', offset=1, limit=1)], [2])
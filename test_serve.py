@@ -0,0 +1,40 @@
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from serve import create_async_app, patch_psycopg_for_gevent, restrict_to_reads
+
+class ReadOnlyServingTestCase(TestCase):
+    """Tests that the async serving mode only answers the read-only pages."""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.add_url_rule('/users', 'blogly.user_list', lambda: 'users')
+        app.add_url_rule('/users', 'blogly.create_user', lambda: 'created', methods=['POST'])
+        app.add_url_rule('/cache/stats', 'blogly.cache_stats', lambda: 'stats')
+        self.client = restrict_to_reads(app).test_client()
+
+    def test_read_pages_are_served(self):
+        resp = self.client.get('/users')
+
+        self.assertEqual(resp.get_data(as_text=True), 'users')
+
+    def test_writes_and_other_pages_are_refused(self):
+        self.assertEqual(self.client.post('/users').status_code, 404)
+        self.assertEqual(self.client.get('/cache/stats').status_code, 404)
+
+    def test_async_app_makes_psycopg_cooperative(self):
+        with patch('serve.patch_psycopg_for_gevent') as patch_psycopg, \
+                patch('app.create_app', return_value=Flask(__name__)) as create_app:
+            app = create_async_app(TESTING=True)
+
+        patch_psycopg.assert_called_once_with()
+        create_app.assert_called_once_with(TESTING=True)
+        self.assertEqual(app.test_client().get('/cache/stats').status_code, 404)
+
+    def test_async_mode_refuses_to_start_without_psycogreen(self):
+        with patch.dict(sys.modules, {'psycogreen.gevent': None}):
+            with self.assertRaises(ImportError):
+                patch_psycopg_for_gevent()